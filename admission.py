@@ -0,0 +1,159 @@
+# admission.py — ограничение одновременной обработки апдейтов по полосам
+#
+# aiogram запускает обработку каждого апдейта сразу и без лимита, поэтому
+# поток обычных сообщений может занять все соединения с БД, и нажатия кнопок
+# будут ждать за ним. Здесь у кнопок (callback_query) и у остальных апдейтов
+# свои полосы: в каждой ограничено число обрабатываемых одновременно и число
+# ждущих очереди. Кроме того, у одного пользователя в полосе обрабатывается
+# не больше нескольких апдейтов сразу. Лишние кнопки пользователя
+# отбрасываются, а лишние сообщения ждут своей очереди: части альбома и серии
+# сообщений не должны теряться. Что не помещается в очередь полосы —
+# отбрасывается: сообщение молча, кнопка — с всплывающим «попробуйте ещё раз»,
+# чтобы не висели «часики».
+import asyncio
+import os
+import time
+
+from aiogram.types import Update
+
+import logs
+import metrics
+from logs import kv
+
+ADMISSION_CALLBACK_CONCURRENCY = int(os.getenv("ADMISSION_CALLBACK_CONCURRENCY", "32"))
+ADMISSION_CALLBACK_QUEUE = int(os.getenv("ADMISSION_CALLBACK_QUEUE", "500"))
+ADMISSION_CALLBACK_PER_USER = int(os.getenv("ADMISSION_CALLBACK_PER_USER", "5"))
+ADMISSION_MESSAGE_CONCURRENCY = int(os.getenv("ADMISSION_MESSAGE_CONCURRENCY", "16"))
+ADMISSION_MESSAGE_QUEUE = int(os.getenv("ADMISSION_MESSAGE_QUEUE", "200"))
+ADMISSION_MESSAGE_PER_USER = int(os.getenv("ADMISSION_MESSAGE_PER_USER", "3"))
+
+CALLBACK = "callback"
+MESSAGE = "message"
+
+SHED_TEXT = "⏳ Бот перегружен, нажмите ещё раз через пару секунд."
+
+log = logs.get("admission")
+
+ADMISSION_WAIT = metrics.Histogram("bot_admission_wait_seconds", "Ожидание места в полосе", ("lane",))
+ADMISSION_ACTIVE = metrics.Gauge("bot_admission_active", "Апдейтов в обработке", ("lane",))
+ADMISSION_QUEUED = metrics.Gauge("bot_admission_queued", "Апдейтов в очереди полосы", ("lane",))
+ADMISSION_CAPACITY = metrics.Gauge("bot_admission_capacity", "Предел одновременной обработки", ("lane",))
+ADMISSION_SHED = metrics.Counter("bot_admission_shed_total", "Отброшенные апдейты", ("lane", "reason"))
+
+
+class Lane:
+    """
+    Не больше `concurrency` апдейтов в работе и `max_queue` в ожидании, по
+    `per_user` на пользователя. С queue_user_overflow лишние апдейты
+    пользователя ждут в очереди полосы, а не отбрасываются.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, per_user: int,
+                 queue_user_overflow: bool = False):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.queue_user_overflow = queue_user_overflow
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._active = 0
+        self._queued = 0
+        self._by_user: dict[int, int] = {}
+        self._user_slots: dict[int, asyncio.Semaphore] = {}
+        ADMISSION_CAPACITY.set(concurrency, name)
+        self._publish()
+
+    def _publish(self):
+        ADMISSION_ACTIVE.set(self._active, self.name)
+        ADMISSION_QUEUED.set(self._queued, self.name)
+
+    def refuse(self, user_id: int | None) -> str | None:
+        """Причина отказа или None, если апдейт можно поставить в полосу."""
+        busy = user_id is not None and self._by_user.get(user_id, 0) >= self.per_user
+        if busy and not self.queue_user_overflow:
+            return "user_limit"
+        if (busy or self._semaphore.locked()) and self._queued >= self.max_queue:
+            return "queue_full"
+        return None
+
+    async def run(self, user_id: int | None, handler, event: Update, data: dict):
+        slot = None
+        if user_id is not None:
+            self._by_user[user_id] = self._by_user.get(user_id, 0) + 1
+            if self.queue_user_overflow:
+                slot = self._user_slots.get(user_id)
+                if slot is None:
+                    slot = self._user_slots[user_id] = asyncio.Semaphore(self.per_user)
+        try:
+            started = time.perf_counter()
+            self._queued += 1
+            self._publish()
+            try:
+                if slot is not None:
+                    await slot.acquire()
+                try:
+                    await self._semaphore.acquire()
+                except BaseException:
+                    if slot is not None:
+                        slot.release()
+                    raise
+            finally:
+                self._queued -= 1
+            ADMISSION_WAIT.observe(time.perf_counter() - started, self.name)
+            self._active += 1
+            self._publish()
+            try:
+                return await handler(event, data)
+            finally:
+                self._active -= 1
+                self._semaphore.release()
+                if slot is not None:
+                    slot.release()
+                self._publish()
+        finally:
+            if user_id is not None:
+                left = self._by_user[user_id] - 1
+                if left:
+                    self._by_user[user_id] = left
+                else:
+                    # Апдейтов пользователя в полосе не осталось — его семафор никто не ждёт
+                    del self._by_user[user_id]
+                    self._user_slots.pop(user_id, None)
+
+
+class AdmissionControl:
+    """
+    Внешний middleware на dp.update: раскладывает апдейты по полосам. Должен
+    стоять раньше FSM-middleware, иначе каждый апдейт, даже отброшенный,
+    успевает прочитать состояние из БД.
+    """
+
+    def __init__(self):
+        self.lanes = {
+            CALLBACK: Lane(CALLBACK, ADMISSION_CALLBACK_CONCURRENCY, ADMISSION_CALLBACK_QUEUE,
+                           ADMISSION_CALLBACK_PER_USER),
+            MESSAGE: Lane(MESSAGE, ADMISSION_MESSAGE_CONCURRENCY, ADMISSION_MESSAGE_QUEUE,
+                          ADMISSION_MESSAGE_PER_USER, queue_user_overflow=True),
+        }
+
+    async def middleware(self, handler, event: Update, data: dict):
+        lane = self.lanes[CALLBACK if event.callback_query is not None else MESSAGE]
+        user = getattr(event.event, "from_user", None)
+        user_id = user.id if user is not None else None
+
+        reason = lane.refuse(user_id)
+        if reason is not None:
+            ADMISSION_SHED.inc(lane.name, reason)
+            log.warning("Апдейт отброшен: полоса переполнена", extra=kv(
+                lane=lane.name, user_id=user_id, update_id=event.update_id, reason=reason
+            ))
+            if event.callback_query is not None:
+                await self._answer_shed(data["bot"], event.callback_query.id)
+            return None
+        return await lane.run(user_id, handler, event, data)
+
+    async def _answer_shed(self, bot, callback_query_id: str):
+        try:
+            await bot.answer_callback_query(callback_query_id, text=SHED_TEXT)
+        except Exception as e:
+            log.warning("Не удалось ответить на отброшенную кнопку", extra=kv(error=e, reason=type(e).__name__))
@@ -0,0 +1,72 @@
+# archive.py — перенос закрытых задач из tasks в помесячно секционированный tasks_history
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import db
+import logs
+from logs import kv
+
+# Закрытые задачи старше ARCHIVE_AFTER_DAYS уезжают в архив пачками по ARCHIVE_BATCH_SIZE
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "7"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+
+log = logs.get("archive")
+
+
+def _month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(month: datetime) -> datetime:
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+async def ensure_partitions(since: datetime, until: datetime):
+    """Создаёт секции tasks_history для всех месяцев от since до until включительно."""
+    month = _month_start(since)
+    async with db.acquire() as conn:
+        while month <= until:
+            upper = _next_month(month)
+            await conn.execute(
+                f"CREATE TABLE IF NOT EXISTS tasks_history_{month:%Y_%m} PARTITION OF tasks_history "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+            )
+            month = upper
+
+
+async def archive_closed_tasks(max_age: timedelta = timedelta(days=ARCHIVE_AFTER_DAYS),
+                               batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Переносит закрытые задачи старше max_age: DELETE ... RETURNING в
+    INSERT INTO tasks_history, по batch_size строк за транзакцию.
+    Возвращает число перенесённых задач.
+    """
+    cutoff = datetime.now() - max_age
+    oldest = await db.fetchval("oldest_closed_task")
+    if oldest is None or oldest >= cutoff:
+        return 0
+    await ensure_partitions(oldest, cutoff)
+
+    moved = 0
+    while True:
+        status = await db.execute("archive_closed_tasks", cutoff, batch_size)
+        count = int(status.split()[-1])
+        moved += count
+        if count < batch_size:
+            return moved
+        # Между пачками отдаём соединения и цикл событий обработке апдейтов
+        await asyncio.sleep(0)
+
+
+async def archiver():
+    """Фоновая задача лидера: раз в ARCHIVE_INTERVAL секунд разгружает tasks."""
+    while True:
+        try:
+            moved = await archive_closed_tasks()
+            if moved:
+                log.info("Закрытые задачи перенесены в архив", extra=kv(moved=moved))
+        except Exception as e:
+            log.error("Ошибка переноса в архив", extra=kv(error=e, reason=type(e).__name__))
+        await asyncio.sleep(ARCHIVE_INTERVAL)
@@ -0,0 +1,93 @@
+# bench/fake_api.py — локальная замена Telegram Bot API для нагрузочных тестов
+#
+# Понимает методы, которые вызывает бот (sendMessage, editMessageText,
+# answerCallbackQuery и служебные), умеет добавлять задержку и отвечать 429.
+# Бот направляется сюда через TELEGRAM_API_URL.
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Deadline Bench", "username": "deadline_bench_bot"}
+
+
+class FakeBotAPI:
+    """
+    latency — средняя задержка ответа в секундах (±50% случайного разброса),
+    rate_limit_ratio — доля запросов, на которые отвечаем 429 с retry_after.
+    """
+
+    def __init__(self, latency: float = 0.0, rate_limit_ratio: float = 0.0, retry_after: int = 1):
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.calls: Counter = Counter()
+        self.rate_limited = 0
+        self._message_ids = itertools.count(1)
+        self._runner: web.AppRunner | None = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер и возвращает базовый адрес для TELEGRAM_API_URL."""
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def reset(self):
+        self.calls.clear()
+        self.rate_limited = 0
+
+    # === ОБРАБОТКА МЕТОДОВ ===
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post()) if request.can_read_body else {}
+        self.calls[method] += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+        if self.rate_limit_ratio and random.random() < self.rate_limit_ratio:
+            self.rate_limited += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(params)
+        return True
+
+    def _message(self, params: dict) -> dict:
+        message = {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = json.loads(params["reply_markup"])
+        return message
@@ -0,0 +1,292 @@
+# bench/run.py — нагрузочный прогон бота против фальшивого Bot API и локального Postgres
+#
+# Запуск из корня репозитория:
+#   BENCH_DATABASE_URL=postgresql://localhost/deadline_bench python -m bench.run
+#
+# База BENCH_DATABASE_URL очищается перед прогоном — не указывайте рабочую.
+# После каждой фазы проверяется результат (задачи в БД, ошибки хендлеров,
+# вызовы фальшивого API); если проверка не прошла, код возврата — 1.
+# Сценарии:
+#   flow   — полный мастер /newtask → assign_to_self → текст → дата → час → select_minute
+#   flood  — поток обычных сообщений в handle_any_message, включая отправку
+#            запросов «Создать задачу?» (серии сбрасываются в конце фазы)
+#   due    — N просроченных напоминаний, время check_due_tasks
+#   restore — N напоминаний в пределах RESTORE_HORIZON, время restore_pending_checks
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from aiogram.types import Update
+
+import callbacks as cb
+from bench.fake_api import FakeBotAPI
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+
+SEED_TASKS = """
+    WITH t AS (
+        INSERT INTO tasks (creator_id, assignee_id, text, deadline, created_at, checkpoints_enabled)
+        SELECT 1000000 + g, 2000000 + g, 'Нагрузочная задача ' || g,
+               $2::timestamp + (g % $3) * INTERVAL '1 second', $2::timestamp - INTERVAL '1 day', FALSE
+        FROM generate_series(1, $1) AS g
+        RETURNING id, deadline
+    )
+    INSERT INTO reminders (task_id, kind, fire_at)
+    SELECT id, 'final', deadline FROM t
+"""
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class Bench:
+    def __init__(self, bot_module, api: FakeBotAPI):
+        self.bot = bot_module
+        self.api = api
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1_000_000)
+        self.round_trips = 0
+        self.latencies: list[float] = []
+        self.errors = 0
+        self.failures: list[str] = []
+
+    def count_query(self, conn):
+        conn.add_query_logger(self._on_query)
+
+    def _on_query(self, record):
+        self.round_trips += 1
+
+    # === СИНТЕТИЧЕСКИЕ АПДЕЙТЫ ===
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Bench {user_id}", "username": f"bench{user_id}"}
+
+    def message(self, user_id: int, text: str) -> dict:
+        return {
+            "update_id": next(self.update_ids),
+            "message": {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+                **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text)}]}
+                   if text.startswith("/") else {}),
+            },
+        }
+
+    def callback(self, user_id: int, data: str) -> dict:
+        return {
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(next(self.update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": next(self.message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "Deadline Bench"},
+                    "text": "…",
+                },
+            },
+        }
+
+    async def feed(self, payload: dict):
+        update = Update.model_validate(payload, context={"bot": self.bot.bot})
+        started = time.perf_counter()
+        try:
+            await self.bot.dp.feed_update(self.bot.bot, update)
+        except Exception as e:
+            self.errors += 1
+            if self.errors <= 5:
+                print(f"[BENCH] Ошибка в апдейте {update.update_id}: {e}")
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+    async def new_task_flow(self, user_id: int):
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        await self.feed(self.message(user_id, "/newtask"))
+        await self.feed(self.callback(user_id, cb.AssignToSelf().pack()))
+        await self.feed(self.message(user_id, f"Задача пользователя {user_id}"))
+        await self.feed(self.callback(user_id, cb.SelectDate(tomorrow).pack()))
+        await self.feed(self.callback(user_id, cb.SelectHour(12).pack()))
+        await self.feed(self.callback(user_id, cb.SelectMinute(30).pack()))
+
+    async def flood(self, user_id: int, messages: int):
+        for i in range(messages):
+            await self.feed(self.message(user_id, f"Сообщение {i} от {user_id}"))
+
+    # === ПРОВЕРКИ ===
+    def check(self, name: str, ok: bool, detail: str):
+        if ok:
+            print(f"[BENCH] {name}: ✓ {detail}")
+        else:
+            self.failures.append(f"{name}: {detail}")
+            print(f"[BENCH] {name}: ПРОВЕРКА НЕ ПРОЙДЕНА — {detail}")
+
+    def expect_calls(self, name: str, method: str, expected: int):
+        got = self.api.calls[method]
+        self.check(name, got == expected, f"{method}: {got}, ожидалось {expected}")
+
+    # === ЗАМЕР ФАЗЫ ===
+    async def phase(self, name: str, jobs, concurrency: int, settle=None):
+        """settle — корутина-функция, которая доводит отложенную работу фазы до конца (входит в замер)"""
+        self.latencies = []
+        self.errors = 0
+        self.api.reset()
+        trips_before = self.round_trips
+        handler_errors = self.bot.metrics.HANDLER_ERRORS.total()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(job):
+            async with semaphore:
+                await job
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(job) for job in jobs))
+        if settle is not None:
+            await settle()
+        elapsed = time.perf_counter() - started
+
+        count = len(self.latencies)
+        trips = self.round_trips - trips_before
+        print(
+            f"[BENCH] {name}: апдейтов {count} за {elapsed:.2f} с — {count / elapsed:.0f} upd/s, "
+            f"p50 {percentile(self.latencies, 0.5) * 1000:.1f} мс, "
+            f"p99 {percentile(self.latencies, 0.99) * 1000:.1f} мс, "
+            f"запросов к БД на апдейт {trips / max(count, 1):.2f}, ошибок {self.errors}, "
+            f"вызовов API {sum(self.api.calls.values())} (429: {self.api.rate_limited})"
+        )
+        handler_errors = self.bot.metrics.HANDLER_ERRORS.total() - handler_errors
+        self.check(name, not self.errors and not handler_errors,
+                   f"исключений в feed_update {self.errors}, в хендлерах {handler_errors:.0f}")
+
+    async def timed(self, name: str, coro):
+        self.api.reset()
+        trips_before = self.round_trips
+        started = time.perf_counter()
+        result = await coro
+        elapsed = time.perf_counter() - started
+        print(
+            f"[BENCH] {name}: {elapsed:.2f} с, запросов к БД {self.round_trips - trips_before}, "
+            f"вызовов API {sum(self.api.calls.values())} (429: {self.api.rate_limited}), результат {result}"
+        )
+        return result
+
+
+async def reset_database(conn):
+    await conn.execute("TRUNCATE reminders, tasks, tasks_history, recent_assignees, fsm_states, users RESTART IDENTITY CASCADE")
+
+
+async def run(args):
+    api = FakeBotAPI(latency=args.latency / 1000, rate_limit_ratio=args.rate_limit)
+    base_url = await api.start()
+
+    # Окружение выставляется до импорта bot: он читает его при загрузке модуля
+    os.environ["TELEGRAM_API_URL"] = base_url
+    os.environ["DATABASE_URL"] = BENCH_DATABASE_URL
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+    os.environ.setdefault("METRICS_PORT", "0")
+    # Лимиты доставки рассчитаны на настоящий Telegram; здесь меряем сам бот
+    os.environ.setdefault("DELIVERY_GLOBAL_RATE", "100000")
+    os.environ.setdefault("DELIVERY_CHAT_RATE", "100000")
+    os.environ.setdefault("DELIVERY_CHAT_BURST", "100000")
+    # Серии сбрасываются явно в конце фазы flood, а не по таймеру
+    os.environ.setdefault("COALESCE_WINDOW", "60")
+    os.environ.setdefault("COALESCE_MAX_DELAY", "60")
+    import bot
+    import db
+
+    bench = Bench(bot, api)
+    await bot.init_db()
+    await db.create_pool(BENCH_DATABASE_URL, setup=bench.count_query)
+    async with db.acquire() as conn:
+        await reset_database(conn)
+    bot.delivery.start()
+    bot.users.start()
+    try:
+        users = range(3_000_000, 3_000_000 + args.users)
+        await bench.phase("flow /newtask", [bench.new_task_flow(uid) for uid in users], args.concurrency)
+        async with db.acquire() as conn:
+            created = await conn.fetchval(
+                "SELECT count(*) FROM tasks WHERE creator_id = ANY($1::bigint[])", list(users)
+            )
+        bench.check("flow /newtask", created == args.users, f"создано задач {created} из {args.users}")
+        # На пользователя: 2 сообщения (выбор исполнителя, календарь) и 4 нажатия кнопок
+        bench.expect_calls("flow /newtask", "sendMessage", 2 * args.users)
+        bench.expect_calls("flow /newtask", "editMessageText", 4 * args.users)
+        bench.expect_calls("flow /newtask", "answerCallbackQuery", 4 * args.users)
+
+        await bench.phase(
+            "flood handle_any_message",
+            [bench.flood(uid, args.messages) for uid in range(4_000_000, 4_000_000 + args.users)],
+            args.concurrency,
+            # handle_any_message только копит серию — запросы уходят при сбросе
+            settle=bot.coalescer.stop,
+        )
+        # Окно склейки в прогоне заведомо больше серии: один запрос на пользователя
+        bench.expect_calls("flood handle_any_message", "sendMessage", args.users)
+
+        # Просроченные разбираются до восстановления: restore раздвинул бы их по окну догонки
+        now = datetime.now()
+        async with db.acquire() as conn:
+            await conn.execute(SEED_TASKS, args.tasks, now - timedelta(hours=1), 1800)
+            await conn.execute("ANALYZE tasks; ANALYZE reminders")
+        print(f"[BENCH] Засеяно просроченных задач: {args.tasks}")
+        retry = await bench.timed("check_due_tasks", bot.check_due_tasks())
+        async with db.acquire() as conn:
+            sent = await conn.fetchval("SELECT count(*) FROM reminders WHERE outcome = 'sent'")
+        bench.check("check_due_tasks", not retry and sent == args.tasks,
+                    f"отправлено {sent} из {args.tasks}, отложено {retry}")
+        bench.expect_calls("check_due_tasks", "sendMessage", args.tasks)
+
+        now = datetime.now()
+        async with db.acquire() as conn:
+            await conn.execute(SEED_TASKS, args.tasks, now + timedelta(minutes=1), int(bot.RESTORE_HORIZON.total_seconds()) - 120)
+            await conn.execute("ANALYZE tasks; ANALYZE reminders")
+        print(f"[BENCH] Засеяно предстоящих задач: {args.tasks}")
+        # В куче уже лежат напоминания задач из сценария flow — считаем только прирост
+        before = len(bot.scheduler)
+        await bench.timed("restore_pending_checks", bot.restore_pending_checks())
+        restored = len(bot.scheduler) - before
+        bench.check("restore_pending_checks", restored == args.tasks,
+                    f"в куче {restored} напоминаний из {args.tasks}")
+    finally:
+        await bot.users.stop()
+        await bot.delivery.stop()
+        await db.close_pool()
+        await bot.bot.session.close()
+        await api.stop()
+
+    if bench.failures:
+        print(f"[BENCH] Не пройдено проверок: {len(bench.failures)}")
+    return len(bench.failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота дедлайнов")
+    parser.add_argument("--users", type=int, default=200, help="пользователей в сценариях flow и flood")
+    parser.add_argument("--messages", type=int, default=10, help="сообщений на пользователя в flood")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременно обрабатываемых пользователей")
+    parser.add_argument("--tasks", type=int, default=10000, help="задач для сценариев due и restore")
+    parser.add_argument("--latency", type=float, default=20, help="задержка фальшивого API, мс")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="доля ответов 429 от фальшивого API")
+    args = parser.parse_args()
+
+    if not BENCH_DATABASE_URL:
+        sys.exit("BENCH_DATABASE_URL не задан: укажите отдельную базу, она будет очищена")
+    if asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
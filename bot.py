@@ -1,6 +1,9 @@
 # bot.py — версия 28: стабильная версия с отложенным восстановлением напоминаний
 import os
 import asyncio
+import html
+from collections import Counter
+import time
 from datetime import datetime, timedelta
 
 from aiogram import Bot, Dispatcher, Router, F
@@ -8,25 +11,71 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardButton
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 import asyncpg
 from dotenv import load_dotenv
 
+import db
+from migrations import run_migrations
+from scheduler import ReminderScheduler, Reminder, CHECK_50, CHECK_90, FINAL
+from delivery import DeliveryQueue
+from webhook import run_webhook
+from storage import PostgresStorage
+from users import UserDirectory, format_name
+import keyboards
+import callbacks as cb
+from leader import LeaderElection
+from admission import AdmissionControl
+from archive import archiver
+from coalesce import MessageCoalescer
+from workers import WORKER_PROCESSES, run_front
+import metrics
+import logs
+from logs import kv
+
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Необязательный адрес Bot API (локальный сервер или заглушка для нагрузочных тестов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
 
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не задан. Добавьте его в Railway Variables.")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL не задан. Убедитесь, что PostgreSQL привязан к сервису.")
 
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+if TELEGRAM_API_URL:
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=BOT_TOKEN)
+delivery = DeliveryQueue(bot)
+leader = LeaderElection(DATABASE_URL)
+storage = PostgresStorage()
+# FSM-middleware aiogram подключается вручную: до него апдейт проходит полосу
+# допуска (чтение состояния из БД — уже работа, которую нужно ограничивать)
+# и открывает кэш чтений хранилища
+dp = Dispatcher(storage=storage, disable_fsm=True)
+admission = AdmissionControl()
+dp.update.outer_middleware(admission.middleware)
+dp.update.outer_middleware(metrics.update_middleware)
+dp.update.outer_middleware(storage.batch_middleware)
+dp.update.outer_middleware(dp.fsm)
+# Изменения FSM сохраняются перед каждым вызовом Bot API из обработчика
+bot.session.middleware(storage.request_middleware)
 router = Router()
+log = logs.get("bot")
+router.message.middleware(metrics.handler_middleware)
+# Кнопки замеряет CallbackRoutes.dispatch — по имени хендлера из таблицы маршрутов
+callback_routes = cb.CallbackRoutes()
+metrics.SEND_QUEUE_DEPTH.set_function(delivery.depth)
+metrics.SEND_IN_FLIGHT.set_function(delivery.in_flight)
 
 class TaskCreation(StatesGroup):
     waiting_for_assignee = State()
@@ -40,133 +89,82 @@ class TaskCreation(StatesGroup):
 async def init_db():
     conn = await asyncpg.connect(DATABASE_URL)
     try:
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                full_name TEXT,
-                username TEXT
-            )
-        """)
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS tasks (
-                id SERIAL PRIMARY KEY,
-                creator_id BIGINT NOT NULL,
-                assignee_id BIGINT NOT NULL,
-                text TEXT NOT NULL,
-                deadline TIMESTAMP NOT NULL,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT NOW(),
-                last_check_time TIMESTAMP,
-                checkpoints_enabled BOOLEAN DEFAULT TRUE
-            )
-        """)
+        await run_migrations(conn)
     finally:
         await conn.close()
 
-async def get_db():
-    return await asyncpg.connect(DATABASE_URL)
-
 # === ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ===
-async def save_user(user):
-    conn = await get_db()
-    try:
-        await conn.execute(
-            """
-            INSERT INTO users (user_id, full_name, username) 
-            VALUES ($1, $2, $3)
-            ON CONFLICT (user_id) DO UPDATE 
-            SET full_name = $2, username = $3
-            """,
-            user.id, user.full_name or "", user.username or ""
-        )
-    finally:
-        await conn.close()
+users = UserDirectory()
 
-def format_name(user_id: int, full_name: str, username: str) -> str:
-    if username:
-        return f"@{username}"
-    if full_name and full_name.strip():
-        return full_name
-    return f"Пользователь {user_id}"
+def save_user(user):
+    users.remember(user)
 
 async def get_frequent_assignees(creator_id: int):
-    conn = await get_db()
-    try:
-        rows = await conn.fetch("""
-            SELECT u.user_id, u.full_name, u.username
-            FROM tasks t
-            JOIN users u ON t.assignee_id = u.user_id
-            WHERE t.creator_id = $1 AND u.user_id != $1
-            GROUP BY u.user_id, u.full_name, u.username
-            ORDER BY MAX(t.created_at) DESC
-            LIMIT 10
-        """, creator_id)
-        return rows
-    finally:
-        await conn.close()
+    return await db.fetch("frequent_assignees", creator_id)
+
+async def build_assignee_keyboard(creator_id: int):
+    frequent = await get_frequent_assignees(creator_id)
+    return keyboards.assignee_picker(frequent)
 
 # === ПЛАНИРОВЩИК НАПОМИНАНИЙ ===
-async def schedule_all_checks(bot: Bot, task_id: int, creator_id: int, assignee_id: int, task_text: str, deadline: datetime, checkpoints_enabled: bool):
-    now = datetime.now()
-    if deadline <= now:
-        return
-    total_seconds = (deadline - now).total_seconds()
+def reminder_message(kind: str, task_id: int, creator_id: int, text: str):
+    """Текст и клавиатура напоминания данного вида"""
+    if kind == FINAL:
+        return f"⏰ Время вышло! Вы выполнили задачу?\n\n«{text}»", keyboards.final(task_id, creator_id)
+    if kind == CHECK_90:
+        return f"⚠️ Скоро дедлайн! Как продвигается задача?\n\n«{text}»", keyboards.interim(task_id, creator_id)
+    return f"🔄 Как продвигается задача?\n\n«{text}»", keyboards.interim(task_id, creator_id)
+
+def reminder_times(now: datetime, deadline: datetime, checkpoints_enabled: bool) -> list:
+    """Моменты срабатывания напоминаний задачи: [(вид, время), ...]"""
+    total = deadline - now
+    times = []
     if checkpoints_enabled:
-        delay_50 = total_seconds * 0.5
-        asyncio.create_task(schedule_intermediate_check(bot, task_id, creator_id, assignee_id, task_text, delay_50))
-        delay_90 = total_seconds * 0.9
-        asyncio.create_task(schedule_intermediate_check(bot, task_id, creator_id, assignee_id, task_text, delay_90))
-    delay_final = total_seconds
-    asyncio.create_task(schedule_final_check(bot, task_id, creator_id, assignee_id, task_text, delay_final))
-
-async def schedule_intermediate_check(bot: Bot, task_id: int, creator_id: int, assignee_id: int, task_text: str, delay: float):
-    await asyncio.sleep(delay)
-    msg = f"🔄 Как продвигается задача?\n\n«{task_text}»"
-    kb = InlineKeyboardBuilder()
-    kb.button(text="✅ Готово", callback_data=f"interim_done_{task_id}_{creator_id}")
-    kb.button(text="⏳ В процессе", callback_data=f"interim_ok_{task_id}")
-    kb.button(text="⚠️ Проблемы", callback_data=f"interim_problem_{task_id}_{creator_id}")
-    kb.adjust(1)
-    try:
-        await bot.send_message(assignee_id, msg, reply_markup=kb.as_markup())
-    except Exception as e:
-        print(f"[SEND ERROR] Не удалось отправить промежуточное напоминание: {e}")
-
-async def schedule_final_check(bot: Bot, task_id: int, creator_id: int, assignee_id: int, task_text: str, delay: float):
-    await asyncio.sleep(delay)
-    kb = InlineKeyboardBuilder()
-    kb.button(text="✅ Выполнено", callback_data=f"done_{task_id}_{creator_id}")
-    kb.button(text="❌ Не сделано", callback_data=f"notdone_{task_id}_{creator_id}")
-    kb.adjust(1)
-    try:
-        await bot.send_message(assignee_id, f"⏰ Время вышло! Вы выполнили задачу?\n\n«{task_text}»", reply_markup=kb.as_markup())
-    except Exception as e:
-        print(f"[SEND ERROR] Не удалось отправить финальное напоминание: {e}")
+        times.append((CHECK_50, now + total * 0.5))
+        times.append((CHECK_90, now + total * 0.9))
+    times.append((FINAL, deadline))
+    return times
+
+async def send_reminder(reminder: Reminder):
+    """Срабатывание таймера: захватываем строку reminders и отправляем, если она ещё не отправлена"""
+    if REMINDER_DIGEST_WINDOW > 0:
+        rows = await db.fetch(
+            "claim_reminder_digest", reminder.task_id, reminder.kind, datetime.now(), REMINDER_DIGEST_WINDOW
+        )
+    else:
+        rows = await db.fetch("claim_reminder", reminder.task_id, reminder.kind, datetime.now())
+    if rows:
+        await deliver_claimed(rows)
+
+scheduler = ReminderScheduler(on_fire=send_reminder)
+metrics.SCHEDULED_REMINDERS.set_function(scheduler.__len__)
+
+def schedule_all_checks(task_id: int, times: list):
+    now = datetime.now()
+    for kind, fire_at in times:
+        if fire_at > now:
+            scheduler.add(fire_at, task_id, kind)
 
 # === ФУНКЦИЯ ЗАПРОСА ПОДТВЕРЖДЕНИЯ ПРЕРЫВАНИЯ ===
 async def ask_to_cancel_current_task(message_or_callback, state: FSMContext, next_action):
     """Показывает кнопку подтверждения прерывания текущей задачи"""
-    builder = InlineKeyboardBuilder()
-    builder.button(text="✅ Продолжить", callback_data=f"confirm_{next_action}")
-    builder.button(text="❌ Отмена", callback_data="cancel_new_task")
-    builder.adjust(2)
-    
+    kb = keyboards.confirm_new_task(next_action)
     if isinstance(message_or_callback, Message):
         await message_or_callback.answer(
             "⚠️ Вы уже создаёте задачу. Начать новую и отменить текущую?",
-            reply_markup=builder.as_markup()
+            reply_markup=kb
         )
     else:
         await message_or_callback.message.edit_text(
             "⚠️ Вы уже создаёте задачу. Начать новую и отменить текущую?",
-            reply_markup=builder.as_markup()
+            reply_markup=kb
         )
     await state.update_data(pending_action=next_action)
 
 # === ОБРАБОТКА ПОДТВЕРЖДЕНИЯ ===
-@router.callback_query(F.data.startswith("confirm_"))
-async def confirm_new_task(callback: CallbackQuery, state: FSMContext):
-    action = callback.data.split("_", 1)[1]
+@callback_routes.on(cb.ConfirmNewTask)
+async def confirm_new_task(callback: CallbackQuery, payload: cb.ConfirmNewTask, state: FSMContext):
+    action = payload.action
     await state.clear()
     
     if action == "newtask":
@@ -177,54 +175,111 @@ async def confirm_new_task(callback: CallbackQuery, state: FSMContext):
         await start_quick_task_from_confirmation(callback, state, quick_text)
     await callback.answer()
 
-@router.callback_query(F.data == "cancel_new_task")
-async def cancel_new_task(callback: CallbackQuery, state: FSMContext):
+@callback_routes.on(cb.CancelNewTask)
+async def cancel_new_task(callback: CallbackQuery, payload: cb.CancelNewTask, state: FSMContext):
     await callback.message.edit_text("↩️ Создание задачи отменено. Продолжайте предыдущую.")
     await callback.answer()
 
 # === ОСНОВНЫЕ КОМАНДЫ ===
 @router.message(Command("start"))
 async def cmd_start(message: Message):
-    await save_user(message.from_user)
+    save_user(message.from_user)
     await message.answer(
         "👋 Привет! Я бот *Deadline* — помогаю ставить задачи и следить за их выполнением.\n\n"
         "Просто отправьте любое сообщение (текст, файл, фото) — и я предложу создать задачу!\n\n"
         "Команды:\n"
         "/newtask — создать задачу вручную\n"
-        "/mytasks — ваши задачи"
+        "/mytasks — ваши задачи\n"
+        "/history — завершённые задачи"
     )
 
+MYTASKS_PAGE_SIZE = 10
+MYTASKS_ROLES = {"a": "Все", "i": "🧑 Мне", "o": "👤 Я поставил"}
+
+# Курсор — полный дедлайн до микросекунд (точность timestamp в Postgres):
+# при обрезанных секундах задачи с одинаковой минутой повторялись бы или терялись
+MYTASKS_CURSOR_FORMAT = "%y%m%d%H%M%S%f"
+
+async def render_my_tasks(user_id: int, role: str = "a", direction: str = "n", cursor: str = "0", cursor_id: int = 0):
+    """
+    Одна страница /mytasks: keyset по (deadline, id), в БД читается только она.
+    Возвращает текст, клавиатуру и признак того, что задач на странице нет.
+    """
+    cursor_dt = datetime.strptime(cursor, MYTASKS_CURSOR_FORMAT) if cursor != "0" else datetime.min
+    rows = await db.fetch(f"mytasks_{role}_{'prev' if direction == 'p' else 'next'}", user_id, cursor_dt, cursor_id, MYTASKS_PAGE_SIZE + 1)
+    has_more = len(rows) > MYTASKS_PAGE_SIZE
+    rows = rows[:MYTASKS_PAGE_SIZE]
+    if direction == "p":
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor != "0", has_more
+
+    builder = InlineKeyboardBuilder()
+    for code, label in MYTASKS_ROLES.items():
+        builder.button(text=f"• {label}" if code == role else label, callback_data=cb.MyTasksPage(code, "n", "0", 0).pack())
+    nav = 0
+    if rows and has_prev:
+        first = rows[0]
+        builder.button(text="◀️", callback_data=cb.MyTasksPage(role, "p", f"{first['deadline']:{MYTASKS_CURSOR_FORMAT}}", first["id"]).pack())
+        nav += 1
+    if rows and has_next:
+        last = rows[-1]
+        builder.button(text="▶️", callback_data=cb.MyTasksPage(role, "n", f"{last['deadline']:{MYTASKS_CURSOR_FORMAT}}", last["id"]).pack())
+        nav += 1
+    builder.adjust(len(MYTASKS_ROLES), *([nav] if nav else []))
+
+    if not rows:
+        return "📭 Нет активных задач в этом разделе.", builder.as_markup(), True
+
+    text = "📋 Ваши задачи:\n\n"
+    for row in rows:
+        t_text = html.escape(row["text"][:200])
+        deadline_fmt = row["deadline"].strftime("%d.%m %H:%M")
+        role_label = "👤 Вы поставили" if row["creator_id"] == user_id else "🧑 Вам назначили"
+        text += f"• {t_text}\n  📅 {deadline_fmt} | {role_label}\n\n"
+    return text, builder.as_markup(), False
+
 @router.message(Command("mytasks"))
 async def my_tasks(message: Message):
-    await save_user(message.from_user)
-    user_id = message.from_user.id
-    conn = await get_db()
-    try:
-        rows = await conn.fetch(
-            """
-            SELECT id, text, deadline, status, creator_id 
-            FROM tasks 
-            WHERE (assignee_id = $1 OR creator_id = $1) 
-              AND status = 'pending'
-            ORDER BY deadline
-            """,
-            user_id
-        )
-    finally:
-        await conn.close()
+    save_user(message.from_user)
+    text, kb, empty = await render_my_tasks(message.from_user.id)
+    if empty:
+        await message.answer("📭 У вас нет активных задач.")
+        return
+    await message.answer(text, parse_mode=ParseMode.HTML, reply_markup=kb)
+
+@callback_routes.on(cb.MyTasksPage)
+async def my_tasks_page(callback: CallbackQuery, payload: cb.MyTasksPage, state: FSMContext):
+    if payload.role not in MYTASKS_ROLES:
+        await callback.answer()
+        return
+    text, kb, _ = await render_my_tasks(
+        callback.from_user.id, payload.role, payload.direction, payload.cursor, payload.cursor_id
+    )
+    await callback.message.edit_text(text, parse_mode=ParseMode.HTML, reply_markup=kb)
+    await callback.answer()
+
+HISTORY_LIMIT = 10
+HISTORY_STATUSES = {"done": "✅", "failed": "❌", "notified": "🔔"}
 
+@router.message(Command("history"))
+async def task_history(message: Message):
+    """Единственный путь чтения архива: tasks_history читается только по запросу"""
+    save_user(message.from_user)
+    user_id = message.from_user.id
+    rows = await db.fetch("task_history", user_id, HISTORY_LIMIT)
     if not rows:
-        await message.answer("📭 У вас нет активных задач.")
+        await message.answer("📭 Завершённых задач пока нет.")
         return
 
-    text = "📋 Ваши задачи:\n\n"
+    text = "🗂 Последние завершённые задачи:\n\n"
     for row in rows:
-        t_text = row["text"]
-        deadline = row["deadline"]
-        creator_id = row["creator_id"]
-        deadline_fmt = deadline.strftime("%d.%m %H:%M")
-        role = "👤 Вы поставили" if creator_id == user_id else "🧑 Вам назначили"
-        text += f"• {t_text}\n  📅 {deadline_fmt} | {role}\n\n"
+        t_text = html.escape(row["text"][:200])
+        mark = HISTORY_STATUSES.get(row["status"], "•")
+        closed_fmt = row["closed_at"].strftime("%d.%m %H:%M")
+        role_label = "👤 Вы поставили" if row["creator_id"] == user_id else "🧑 Вам назначили"
+        text += f"{mark} {t_text}\n  🏁 {closed_fmt} | {role_label}\n\n"
     await message.answer(text, parse_mode=ParseMode.HTML)
 
 @router.message(Command("newtask"))
@@ -241,126 +296,104 @@ async def new_task_start_confirmed(message: Message, state: FSMContext):
     await _start_new_task_flow(message, state)
 
 async def _start_new_task_flow(message: Message, state: FSMContext):
-    await save_user(message.from_user)
-    creator_id = message.from_user.id
-    frequent = await get_frequent_assignees(creator_id)
-
-    builder = InlineKeyboardBuilder()
-    builder.button(text="👤 Себе", callback_data="assign_to_self")
-    if frequent:
-        builder.button(text="— ⭐ Ранее назначали —", callback_data="ignore")
-        for row in frequent:
-            uid = row["user_id"]
-            name = row["full_name"]
-            uname = row["username"]
-            label = format_name(uid, name, uname)
-            builder.button(text=label[:25], callback_data=f"pick_user_{uid}")
-    builder.button(text="📨 Другой пользователь", callback_data="assign_by_forward")
-    builder.adjust(1)
-    
-    await message.answer("👥 Кому назначить задачу?", reply_markup=builder.as_markup())
+    save_user(message.from_user)
+    kb = await build_assignee_keyboard(message.from_user.id)
     await state.set_state(TaskCreation.waiting_for_assignee)
+    await message.answer("👥 Кому назначить задачу?", reply_markup=kb)
 
 # === ГЛОБАЛЬНЫЙ ОБРАБОТЧИК СООБЩЕНИЙ ===
-@router.message()
-async def handle_any_message(message: Message, state: FSMContext):
-    # Игнорируем команды
-    if message.text and (message.text.startswith("/") or message.text.startswith("\\") or message.text.startswith("!")):
-        return
-
-    current_state = await state.get_state()
-    if current_state is not None:
-        await state.update_data(quick_task_text=message.text or "Задача из переписки")
-        await ask_to_cancel_current_task(message, state, "quick_task")
-        return
-
-    await state.clear()
-    await save_user(message.from_user)
-    
-    # Извлекаем текст или генерируем описание для медиа
+QUICK_TASK_TEXT_LIMIT = 2000
+MEDIA_LABELS = (
+    ("photo", "🖼️ Фото"),
+    ("video", "🎥 Видео"),
+    ("document", "📄 Документы"),
+    ("audio", "🎵 Аудио"),
+    ("voice", "🎤 Голосовые"),
+    ("animation", "🎬 Анимации"),
+)
+
+def describe_message(message: Message) -> str:
+    """Текст или описание вложения одного сообщения"""
     if message.text:
-        text = message.text
+        return message.text
     elif message.caption:
-        text = message.caption
+        return message.caption
     elif message.document:
         file_name = message.document.file_name or "документ"
-        text = f"📄 Документ: {file_name}"
+        return f"📄 Документ: {file_name}"
     elif message.photo:
-        text = "🖼️ Фотография"
+        return "🖼️ Фотография"
     elif message.video:
-        text = "🎥 Видео"
+        return "🎥 Видео"
     elif message.audio:
         performer = message.audio.performer or ""
         title = message.audio.title or "аудио"
-        text = f"🎵 Аудио: {performer} – {title}" if performer else f"🎵 {title}"
+        return f"🎵 Аудио: {performer} – {title}" if performer else f"🎵 {title}"
     elif message.voice:
-        text = "🎤 Голосовое сообщение"
+        return "🎤 Голосовое сообщение"
     elif message.animation:
-        text = "🎬 Анимация"
-    else:
-        text = "📎 Вложение"
+        return "🎬 Анимация"
+    return "📎 Вложение"
+
+def summarize_messages(messages: list) -> str:
+    """Текст задачи из серии: тексты и подписи подряд, вложения — одной строкой со счётчиками"""
+    if len(messages) == 1:
+        return describe_message(messages[0])
+    texts = [m.text or m.caption for m in messages if m.text or m.caption]
+    counts = Counter(kind for m in messages for kind, _ in MEDIA_LABELS if getattr(m, kind))
+    media = ", ".join(f"{label}: {counts[kind]}" for kind, label in MEDIA_LABELS if counts[kind])
+    if media:
+        texts.append(f"📎 {media}")
+    return "\n".join(texts)[:QUICK_TASK_TEXT_LIMIT] or "📎 Вложения"
 
-    builder = InlineKeyboardBuilder()
-    builder.button(text="✅ Создать задачу", callback_data="quick_task_from_forward")
-    builder.button(text="❌ Отмена", callback_data="ignore")
-    builder.adjust(2)
-    
-    await message.answer(
-        f"📩 Создать задачу из этого сообщения?\n\n«{text[:150]}{'...' if len(text) > 150 else ''}»",
-        reply_markup=builder.as_markup()
-    )
-    await state.update_data(quick_task_text=text)
+async def handle_any_message(message: Message, state: FSMContext):
+    # Игнорируем команды
+    if message.text and (message.text.startswith("/") or message.text.startswith("\\") or message.text.startswith("!")):
+        return
+    # Альбомы и пачки пересланных сообщений склеиваются в один запрос
+    coalescer.add(message, state)
+
+async def prompt_quick_task(messages: list, state: FSMContext):
+    """Один запрос «Создать задачу?» на серию сообщений: одна запись FSM и одна отправка"""
+    text = summarize_messages(messages)
+    async with storage.batched():
+        current_state = await state.get_state()
+        if current_state is not None:
+            await state.update_data(quick_task_text=text)
+            await ask_to_cancel_current_task(messages[-1], state, "quick_task")
+            return
+
+        await state.clear()
+        save_user(messages[0].from_user)
+        subject = "этого сообщения" if len(messages) == 1 else f"этих сообщений ({len(messages)})"
+        await messages[-1].answer(
+            f"📩 Создать задачу из {subject}?\n\n«{text[:150]}{'...' if len(text) > 150 else ''}»",
+            reply_markup=keyboards.QUICK_TASK_PROMPT
+        )
+        await state.update_data(quick_task_text=text)
+
+coalescer = MessageCoalescer(on_flush=prompt_quick_task)
+metrics.COALESCE_PENDING.set_function(coalescer.pending)
 
 async def start_quick_task_from_confirmation(callback: CallbackQuery, state: FSMContext, quick_text: str):
     await state.update_data(text=quick_text, is_quick_task=True)
-    creator_id = callback.from_user.id
-    frequent = await get_frequent_assignees(creator_id)
-
-    builder = InlineKeyboardBuilder()
-    builder.button(text="👤 Себе", callback_data="assign_to_self")
-    if frequent:
-        builder.button(text="— ⭐ Ранее назначали —", callback_data="ignore")
-        for row in frequent:
-            uid = row["user_id"]
-            name = row["full_name"]
-            uname = row["username"]
-            label = format_name(uid, name, uname)
-            builder.button(text=label[:25], callback_data=f"pick_user_{uid}")
-    builder.button(text="📨 Другой пользователь", callback_data="assign_by_forward")
-    builder.adjust(1)
-    
-    await callback.message.edit_text("👥 Кому назначить задачу?", reply_markup=builder.as_markup())
+    kb = await build_assignee_keyboard(callback.from_user.id)
     await state.set_state(TaskCreation.waiting_for_assignee)
+    await callback.message.edit_text("👥 Кому назначить задачу?", reply_markup=kb)
     await callback.answer()
 
-@router.callback_query(F.data == "quick_task_from_forward")
-async def start_quick_task(callback: CallbackQuery, state: FSMContext):
+@callback_routes.on(cb.QuickTask)
+async def start_quick_task(callback: CallbackQuery, payload: cb.QuickTask, state: FSMContext):
     data = await state.get_data()
     quick_text = data.get("quick_task_text", "Задача из переписки")
     await state.update_data(text=quick_text, is_quick_task=True)
-    
-    creator_id = callback.from_user.id
-    frequent = await get_frequent_assignees(creator_id)
-
-    builder = InlineKeyboardBuilder()
-    builder.button(text="👤 Себе", callback_data="assign_to_self")
-    if frequent:
-        builder.button(text="— ⭐ Ранее назначали —", callback_data="ignore")
-        for row in frequent:
-            uid = row["user_id"]
-            name = row["full_name"]
-            uname = row["username"]
-            label = format_name(uid, name, uname)
-            builder.button(text=label[:25], callback_data=f"pick_user_{uid}")
-    builder.button(text="📨 Другой пользователь", callback_data="assign_by_forward")
-    builder.adjust(1)
-    
-    await callback.message.edit_text("👥 Кому назначить задачу?", reply_markup=builder.as_markup())
+    kb = await build_assignee_keyboard(callback.from_user.id)
     await state.set_state(TaskCreation.waiting_for_assignee)
+    await callback.message.edit_text("👥 Кому назначить задачу?", reply_markup=kb)
     await callback.answer()
 
-@router.callback_query(F.data == "ignore")
-async def ignore_callback(callback: CallbackQuery):
+@callback_routes.on(cb.Ignore)
+async def ignore_callback(callback: CallbackQuery, payload: cb.Ignore, state: FSMContext):
     await callback.answer()
 
 # === УНИВЕРСАЛЬНЫЙ ПЕРЕХОД ПОСЛЕ ВЫБОРА ИСПОЛНИТЕЛЯ ===
@@ -369,55 +402,44 @@ async def proceed_after_assignee(callback_or_message, state: FSMContext):
     is_quick = data.get("is_quick_task", False)
     
     if is_quick:
-        kb = create_7day_calendar()
+        kb = keyboards.calendar()
+        await state.set_state(TaskCreation.waiting_for_date)
         if isinstance(callback_or_message, CallbackQuery):
-            await callback_or_message.message.edit_text("📅 Выберите дату:", reply_markup=kb.as_markup())
+            await callback_or_message.message.edit_text("📅 Выберите дату:", reply_markup=kb)
             await callback_or_message.answer()
         else:
-            await callback_or_message.answer("📅 Выберите дату:", reply_markup=kb.as_markup())
-        await state.set_state(TaskCreation.waiting_for_date)
+            await callback_or_message.answer("📅 Выберите дату:", reply_markup=kb)
     else:
+        await state.set_state(TaskCreation.waiting_for_text)
         if isinstance(callback_or_message, CallbackQuery):
             await callback_or_message.message.edit_text("📝 Напишите текст задачи:")
             await callback_or_message.answer()
         else:
             await callback_or_message.answer("📝 Напишите текст задачи:")
-        await state.set_state(TaskCreation.waiting_for_text)
 
 # === ВЫБОР ИСПОЛНИТЕЛЯ ===
-@router.callback_query(F.data == "assign_to_self")
-async def assign_to_self(callback: CallbackQuery, state: FSMContext):
+@callback_routes.on(cb.AssignToSelf)
+async def assign_to_self(callback: CallbackQuery, payload: cb.AssignToSelf, state: FSMContext):
     await state.update_data(assignee_id=callback.from_user.id, assignee_name="вам")
     await proceed_after_assignee(callback, state)
 
-@router.callback_query(F.data.startswith("pick_user_"))
-async def pick_user(callback: CallbackQuery, state: FSMContext):
-    assignee_id = int(callback.data.split("_")[2])
-    conn = await get_db()
-    try:
-        row = await conn.fetchrow(
-            "SELECT user_id, full_name, username FROM users WHERE user_id = $1",
-            assignee_id
-        )
-    finally:
-        await conn.close()
-        
-    if not row:
+@callback_routes.on(cb.PickUser)
+async def pick_user(callback: CallbackQuery, payload: cb.PickUser, state: FSMContext):
+    assignee_id = payload.user_id
+    assignee_name = await users.display_name(assignee_id)
+
+    if assignee_name is None:
         await callback.message.edit_text("❌ Пользователь не найден.")
         await state.clear()
         return
 
-    uid = row["user_id"]
-    full_name = row["full_name"]
-    username = row["username"]
-    assignee_name = format_name(uid, full_name, username)
     await state.update_data(assignee_id=assignee_id, assignee_name=assignee_name)
     await proceed_after_assignee(callback, state)
 
-@router.callback_query(F.data == "assign_by_forward")
-async def assign_by_forward(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_text("📨 Перешлите любое сообщение от пользователя.")
+@callback_routes.on(cb.AssignByForward)
+async def assign_by_forward(callback: CallbackQuery, payload: cb.AssignByForward, state: FSMContext):
     await state.set_state(TaskCreation.waiting_for_assignee)
+    await callback.message.edit_text("📨 Перешлите любое сообщение от пользователя.")
     await callback.answer()
 
 @router.message(TaskCreation.waiting_for_assignee, F.forward_date)
@@ -441,7 +463,7 @@ async def handle_forwarded(message: Message, state: FSMContext):
         await message.answer("❌ Не могу отправить сообщение этому пользователю.")
         return
 
-    await save_user(user)
+    save_user(user)
     name = format_name(user.id, user.full_name or "", user.username or "")
     await state.update_data(assignee_id=user.id, assignee_name=name)
     await proceed_after_assignee(message, state)
@@ -454,54 +476,29 @@ async def not_forwarded(message: Message):
 @router.message(TaskCreation.waiting_for_text)
 async def process_text(message: Message, state: FSMContext):
     await state.update_data(text=message.text)
-    kb = create_7day_calendar()
-    await message.answer("📅 Выберите дату:", reply_markup=kb.as_markup())
+    kb = keyboards.calendar()
     await state.set_state(TaskCreation.waiting_for_date)
+    await message.answer("📅 Выберите дату:", reply_markup=kb)
 
-def create_7day_calendar() -> InlineKeyboardBuilder:
-    builder = InlineKeyboardBuilder()
-    today = datetime.today().date()
-    for i in range(7):
-        date_obj = today + timedelta(days=i)
-        if i == 0:
-            label = f"Сегодня {date_obj.strftime('%d %b')}"
-        elif i == 1:
-            label = f"Завтра {date_obj.strftime('%d %b')}"
-        else:
-            label = date_obj.strftime("%d %b")
-        date_str = date_obj.strftime("%Y-%m-%d")
-        builder.button(text=label, callback_data=f"select_date_{date_str}")
-    builder.adjust(1)
-    return builder
-
-@router.callback_query(F.data.startswith("select_date_"))
-async def select_date(callback: CallbackQuery, state: FSMContext):
-    date_str = callback.data.split("_", 2)[2]
-    await state.update_data(selected_date=date_str)
-    builder = InlineKeyboardBuilder()
-    for hour in range(24):
-        builder.button(text=f"{hour:02d}:00", callback_data=f"select_hour_{hour}")
-    builder.adjust(6)
-    await callback.message.edit_text("🕗 Выберите час:", reply_markup=builder.as_markup())
+@callback_routes.on(cb.SelectDate)
+async def select_date(callback: CallbackQuery, payload: cb.SelectDate, state: FSMContext):
+    await state.update_data(selected_date=payload.day)
     await state.set_state(TaskCreation.waiting_for_hour)
+    await callback.message.edit_text("🕗 Выберите час:", reply_markup=keyboards.HOURS)
     await callback.answer()
 
-@router.callback_query(F.data.startswith("select_hour_"))
-async def select_hour(callback: CallbackQuery, state: FSMContext):
-    hour = int(callback.data.split("_")[2])
+@callback_routes.on(cb.SelectHour)
+async def select_hour(callback: CallbackQuery, payload: cb.SelectHour, state: FSMContext):
+    hour = payload.hour
     await state.update_data(selected_hour=hour)
-    builder = InlineKeyboardBuilder()
-    for minute in [0, 15, 30, 45]:
-        builder.button(text=f":{minute:02d}", callback_data=f"select_minute_{minute}")
-    builder.adjust(4)
-    await callback.message.edit_text(f"🕗 Выбрано: {hour:02d} часов.\nВыберите минуты:", reply_markup=builder.as_markup())
     await state.set_state(TaskCreation.waiting_for_minute)
+    await callback.message.edit_text(f"🕗 Выбрано: {hour:02d} часов.\nВыберите минуты:", reply_markup=keyboards.MINUTES)
     await callback.answer()
 
-@router.callback_query(F.data.startswith("select_minute_"))
-async def select_minute(callback: CallbackQuery, state: FSMContext):
+@callback_routes.on(cb.SelectMinute)
+async def select_minute(callback: CallbackQuery, payload: cb.SelectMinute, state: FSMContext):
     try:
-        minute = int(callback.data.split("_")[2])
+        minute = payload.minute
         data = await state.get_data()
         date_part = data["selected_date"]
         hour = data["selected_hour"]
@@ -517,199 +514,356 @@ async def select_minute(callback: CallbackQuery, state: FSMContext):
         creator_id = callback.from_user.id
         assignee_id = data["assignee_id"]
         text = data["text"]
-        duration = (deadline - datetime.now()).total_seconds()
+        now = datetime.now()
+        duration = (deadline - now).total_seconds()
         checkpoints_enabled = duration > 600
+        times = reminder_times(now, deadline, checkpoints_enabled)
 
-        conn = await get_db()
-        try:
+        # Задача и её напоминания записываются одной транзакцией
+        async with db.transaction() as conn:
             task_id = await conn.fetchval(
-                """
-                INSERT INTO tasks (creator_id, assignee_id, text, deadline, checkpoints_enabled)
-                VALUES ($1, $2, $3, $4, $5)
-                RETURNING id
-                """,
-                creator_id, assignee_id, text, deadline, checkpoints_enabled
+                db.QUERIES["insert_task"], creator_id, assignee_id, text, deadline, checkpoints_enabled
+            )
+            await conn.execute(
+                db.QUERIES["insert_reminders"], task_id,
+                [kind for kind, _ in times], [fire_at for _, fire_at in times]
             )
-        finally:
-            await conn.close()
+            if assignee_id != creator_id:
+                await conn.execute(db.QUERIES["touch_recent_assignee"], creator_id, assignee_id)
 
         # Запускаем напоминания
-        asyncio.create_task(schedule_all_checks(
-            callback.bot, task_id, creator_id, assignee_id, text, deadline, checkpoints_enabled
-        ))
+        schedule_all_checks(task_id, times)
 
         deadline_fmt = deadline.strftime("%d.%m в %H:%M")
         assignee_name = data["assignee_name"]
         await callback.message.edit_text(f"✅ Задача назначена {assignee_name}!\n📅 Дедлайн: {deadline_fmt}")
 
         if assignee_id != creator_id:
-            try:
-                await callback.bot.send_message(
-                    assignee_id,
-                    f"🔔 Вам назначена новая задача:\n\n«{text}»\n📅 Дедлайн: {deadline_fmt}"
-                )
-            except Exception as e:
-                print(f"[SEND NEW TASK] {e}")
+            delivery.notify(assignee_id, f"🔔 Вам назначена новая задача:\n\n«{text}»\n📅 Дедлайн: {deadline_fmt}")
 
         await state.clear()
         await callback.answer()
 
     except Exception as e:
-        print(f"[ERROR CREATE TASK] {e}")
+        log.error("Ошибка создания задачи", extra=kv(user_id=callback.from_user.id, error=e, reason=type(e).__name__))
         await callback.message.edit_text("⚠️ Произошла ошибка. Попробуйте снова.")
         await state.clear()
         await callback.answer()
 
-# === ФОНОВАЯ ПРОВЕРКА ЗАДАЧ КАЖДЫЕ 5 МИНУТ ===
+# === ФОНОВАЯ ПРОВЕРКА ЗАДАЧ ===
+TASK_EVENTS_CHANNEL = "task_events"
+# Страховочный интервал на случай потерянных уведомлений
+CHECKER_MAX_SLEEP = float(os.getenv("CHECKER_MAX_SLEEP", "300"))
+# Пауза, чтобы собрать пачку уведомлений в один проход
+CHECKER_NOTIFY_DEBOUNCE = float(os.getenv("CHECKER_NOTIFY_DEBOUNCE", "0.5"))
+# Повтор после неудачных отправок
+CHECKER_RETRY_DELAY = float(os.getenv("CHECKER_RETRY_DELAY", "30"))
+
 async def background_checker():
-    while True:
-        try:
-            await check_due_tasks()
-        except Exception as e:
-            print(f"[BACKGROUND ERROR] {e}")
-        await asyncio.sleep(300)
+    """
+    Спит ровно до ближайшего срока (MIN по индексам) и просыпается раньше,
+    если по каналу task_events пришёл NOTIFY о новой задаче или смене статуса.
+    Перед первым циклом восстанавливает напоминания — иначе всё просроченное
+    за время простоя ушло бы одной пачкой.
+    """
+    await bot_ready.wait()
+    try:
+        await restore_pending_checks()
+    except Exception as e:
+        log.error("Ошибка восстановления напоминаний", extra=kv(error=e, reason=type(e).__name__))
 
-async def check_due_tasks():
-    now = datetime.now()
-    conn = await get_db()
+    wake = asyncio.Event()
+    listener = None
     try:
-        rows = await conn.fetch("""
-            SELECT id, creator_id, assignee_id, text, deadline, created_at, last_check_time
-            FROM tasks
-            WHERE status = 'pending' AND deadline > $1 AND checkpoints_enabled = true
-        """, now)
-        
-        for row in rows:
-            task_id = row["id"]
-            creator_id = row["creator_id"]
-            assignee_id = row["assignee_id"]
-            text = row["text"]
-            created_at = row["created_at"]
-            deadline = row["deadline"]
-            last_check = row["last_check_time"]
-            
-            total_duration = (deadline - created_at).total_seconds()
-            if total_duration <= 0:
-                continue
-                
-            time_elapsed = (now - created_at).total_seconds()
-            progress = time_elapsed / total_duration
-            
-            if progress >= 0.5 and last_check is None:
-                msg = f"🔄 Как продвигается задача?\n\n«{text}»"
-                kb = InlineKeyboardBuilder()
-                kb.button(text="✅ Готово", callback_data=f"interim_done_{task_id}_{creator_id}")
-                kb.button(text="⏳ В процессе", callback_data=f"interim_ok_{task_id}")
-                kb.button(text="⚠️ Проблемы", callback_data=f"interim_problem_{task_id}_{creator_id}")
-                kb.adjust(1)
-                try:
-                    await bot.send_message(assignee_id, msg, reply_markup=kb.as_markup())
-                    await conn.execute("UPDATE tasks SET last_check_time = $1 WHERE id = $2", now, task_id)
-                except Exception as e:
-                    print(f"[BACKGROUND SEND] {e}")
-            elif progress >= 0.9 and last_check is not None:
-                msg = f"⚠️ Скоро дедлайн! Как продвигается задача?\n\n«{text}»"
-                kb = InlineKeyboardBuilder()
-                kb.button(text="✅ Готово", callback_data=f"interim_done_{task_id}_{creator_id}")
-                kb.button(text="⏳ В процессе", callback_data=f"interim_ok_{task_id}")
-                kb.button(text="⚠️ Проблемы", callback_data=f"interim_problem_{task_id}_{creator_id}")
-                kb.adjust(1)
+        while True:
+            if listener is None or listener.is_closed():
                 try:
-                    await bot.send_message(assignee_id, msg, reply_markup=kb.as_markup())
-                    await conn.execute("UPDATE tasks SET last_check_time = $1 WHERE id = $2", now, task_id)
+                    listener = await asyncpg.connect(DATABASE_URL)
+                    await listener.add_listener(TASK_EVENTS_CHANNEL, lambda *args: wake.set())
                 except Exception as e:
-                    print(f"[BACKGROUND SEND] {e}")
-        
-        final_rows = await conn.fetch("""
-            SELECT id, creator_id, assignee_id, text
-            FROM tasks
-            WHERE status = 'pending' AND deadline <= $1
-        """, now)
-        
-        for row in final_rows:
-            task_id = row["id"]
-            creator_id = row["creator_id"]
-            assignee_id = row["assignee_id"]
-            text = row["text"]
-            kb = InlineKeyboardBuilder()
-            kb.button(text="✅ Выполнено", callback_data=f"done_{task_id}_{creator_id}")
-            kb.button(text="❌ Не сделано", callback_data=f"notdone_{task_id}_{creator_id}")
-            kb.adjust(1)
+                    log.warning("Не удалось подписаться на task_events", extra=kv(error=e, reason=type(e).__name__))
+                    listener = None
+
+            wake.clear()
+            failed = 0
+            delay = CHECKER_MAX_SLEEP
             try:
-                await bot.send_message(
-                    assignee_id,
-                    f"⏰ Время вышло! Вы выполнили задачу?\n\n«{text}»",
-                    reply_markup=kb.as_markup()
-                )
-                await conn.execute("UPDATE tasks SET status = 'notified' WHERE id = $1", task_id)
+                started = time.perf_counter()
+                failed = await check_due_tasks()
+                elapsed = time.perf_counter() - started
+                metrics.CHECK_CYCLE_SECONDS.set(elapsed)
+                metrics.CHECK_CYCLE_LATENCY.observe(elapsed)
+                next_due = await db.fetchval("next_due_time")
+                if next_due is not None:
+                    delay = min(max((next_due - datetime.now()).total_seconds(), 0), CHECKER_MAX_SLEEP)
             except Exception as e:
-                print(f"[BACKGROUND FINAL] {e}")
-                
+                log.error("Ошибка цикла проверки напоминаний", extra=kv(error=e, reason=type(e).__name__))
+                delay = CHECKER_RETRY_DELAY
+            if failed:
+                delay = max(delay, CHECKER_RETRY_DELAY)
+
+            try:
+                await asyncio.wait_for(wake.wait(), delay)
+                await asyncio.sleep(CHECKER_NOTIFY_DEBOUNCE)
+            except asyncio.TimeoutError:
+                pass
     finally:
-        await conn.close()
+        if listener is not None:
+            listener.terminate()
+
+CLAIM_BATCH_SIZE = int(os.getenv("CLAIM_BATCH_SIZE", "1000"))
+SEND_CHUNK_SIZE = int(os.getenv("SEND_CHUNK_SIZE", "25"))
+# Сколько раз напоминание можно захватить повторно после временных ошибок
+REMINDER_MAX_ATTEMPTS = int(os.getenv("REMINDER_MAX_ATTEMPTS", "5"))
+
+# Режим сводок: напоминания одного исполнителя со сроком в пределах
+# REMINDER_DIGEST_WINDOW секунд уходят одним сообщением (0 — выключено).
+# Напоминание из группы может прийти раньше своего срока не больше чем на окно.
+REMINDER_DIGEST_WINDOW = float(os.getenv("REMINDER_DIGEST_WINDOW", "0"))
+# Задач с кнопками на одной странице сводки
+DIGEST_PAGE_SIZE = int(os.getenv("DIGEST_PAGE_SIZE", "8"))
+
+# Итоги доставки в журнале reminders.outcome
+OUTCOME_SENT = "sent"        # сообщение доставлено
+OUTCOME_SKIPPED = "skipped"  # задача закрыта до отправки — вызова Bot API не было
+OUTCOME_FAILED = "failed"    # Telegram отказал окончательно (бот заблокирован, чат не найден)
+OUTCOME_RETRY = "retry"      # временная ошибка — захват снимается до следующего цикла
+
+async def _task_still_pending(task_id: int) -> bool:
+    """Перепроверка статуса в момент отправки; если БД недоступна — отправляем (захват уже наш)"""
+    try:
+        return await db.fetchval("task_status", task_id) == "pending"
+    except Exception as e:
+        log.warning("Не удалось проверить статус задачи", extra=kv(task_id=task_id, error=e, reason=type(e).__name__))
+        return True
 
-# === ВОССТАНОВЛЕНИЕ НАПОМИНАНИЙ ПРИ СТАРТЕ ===
-async def restore_pending_checks():
-    """Запускает напоминания для всех активных задач при старте бота"""
-    conn = await get_db()
+async def _deliver(chat_id: int, text: str, kb, precheck, **fields) -> tuple[str, int | None]:
+    """Отправка через очередь доставки с разбором ошибок в итог журнала"""
     try:
-        rows = await conn.fetch("""
-            SELECT id, creator_id, assignee_id, text, deadline, checkpoints_enabled
-            FROM tasks
-            WHERE status = 'pending'
-        """)
-    finally:
-        await conn.close()
+        sent = await delivery.send_message(chat_id, text, reply_markup=kb, precheck=precheck)
+    except (TelegramRetryAfter, TelegramNetworkError, TelegramServerError) as e:
+        log.warning("Напоминание отложено до следующего цикла", extra=kv(
+            user_id=chat_id, **fields, error=e, reason=type(e).__name__
+        ))
+        return OUTCOME_RETRY, None
+    except Exception as e:
+        log.warning("Напоминание не доставлено", extra=kv(
+            user_id=chat_id, **fields, error=e, reason=type(e).__name__
+        ))
+        return OUTCOME_FAILED, None
+    if sent is None:
+        return OUTCOME_SKIPPED, None
+    return OUTCOME_SENT, sent.message_id
+
+async def _send_due(row) -> tuple[str, int | None]:
+    if row["status"] != "pending":
+        # Задачу закрыли после постановки напоминания — отправлять нечего
+        return OUTCOME_SKIPPED, None
+    task_id = row["task_id"]
+    msg, kb = reminder_message(row["kind"], task_id, row["creator_id"], row["text"])
+    return await _deliver(
+        row["assignee_id"], msg, kb, lambda: _task_still_pending(task_id), task_id=task_id, kind=row["kind"]
+    )
+
+DIGEST_LABELS = {FINAL: "⏰ дедлайн", CHECK_90: "⚠️ скоро дедлайн", CHECK_50: "🔄 половина срока"}
 
+def digest_items(rows) -> list:
+    """Задачи сводки без повторов: из нескольких напоминаний задачи остаётся самое позднее по смыслу"""
+    items = {}
     for row in rows:
-        task_id = row["id"]
-        creator_id = row["creator_id"]
-        assignee_id = row["assignee_id"]
-        text = row["text"]
-        deadline = row["deadline"]
-        checkpoints_enabled = row["checkpoints_enabled"]
-        
-        asyncio.create_task(schedule_all_checks(
-            bot, task_id, creator_id, assignee_id, text, deadline, checkpoints_enabled
-        ))
-        print(f"[RESTORE] Восстановлены напоминания для задачи {task_id}")
+        item = items.get(row["task_id"])
+        if item is None or row["kind"] > item["kind"]:  # 'final' > 'check_90' > 'check_50'
+            items[row["task_id"]] = row
+    return sorted(items.values(), key=lambda item: (item["deadline"], item["task_id"]))
+
+def render_digest(items: list, page: int = 0):
+    """Текст и клавиатура одной страницы сводки; None вместо текста — задач не осталось"""
+    if not items:
+        return None, None
+    pages = (len(items) + DIGEST_PAGE_SIZE - 1) // DIGEST_PAGE_SIZE
+    page = min(max(page, 0), pages - 1)
+    first = page * DIGEST_PAGE_SIZE
+    chunk = items[first:first + DIGEST_PAGE_SIZE]
+    text = f"📬 Напоминания по задачам: {len(items)}\n\n"
+    for number, item in enumerate(chunk, first + 1):
+        deadline_fmt = item["deadline"].strftime("%d.%m %H:%M")
+        text += f"{number}. {DIGEST_LABELS[item['kind']]} {deadline_fmt}\n«{item['text'][:200]}»\n\n"
+    if pages > 1:
+        text += f"Страница {page + 1} из {pages}"
+    return text, keyboards.digest(chunk, first + 1, page, pages)
+
+async def _any_still_pending(task_ids: list) -> bool:
+    try:
+        return await db.fetchval("count_pending_tasks", task_ids) > 0
+    except Exception as e:
+        log.warning("Не удалось проверить статус задач сводки", extra=kv(tasks=len(task_ids), error=e, reason=type(e).__name__))
+        return True
+
+async def _send_digest(rows) -> tuple[str, int | None]:
+    items = digest_items(rows)
+    msg, kb = render_digest(items)
+    task_ids = [item["task_id"] for item in items]
+    return await _deliver(
+        rows[0]["assignee_id"], msg, kb, lambda: _any_still_pending(task_ids), tasks=len(task_ids)
+    )
+
+async def _send_group(group) -> tuple[str, int | None]:
+    if len(group) == 1:
+        return await _send_due(group[0])
+    return await _send_digest(group)
 
-# === ОТЛОЖЕННОЕ ВОССТАНОВЛЕНИЕ ===
-async def delayed_restore():
-    await asyncio.sleep(5)  # Ждём, пока бот подключится к Telegram
-    await restore_pending_checks()
+def _group_by_assignee(rows) -> list:
+    """Группы для сводок; напоминания закрытых задач остаются поодиночке и пропускаются"""
+    groups = {}
+    for row in rows:
+        key = row["assignee_id"] if row["status"] == "pending" else ("closed", row["id"])
+        groups.setdefault(key, []).append(row)
+    return list(groups.values())
+
+async def _send_in_chunks(rows, send) -> list:
+    """Отправляет порциями по SEND_CHUNK_SIZE, возвращает итоги в порядке строк"""
+    results = []
+    for i in range(0, len(rows), SEND_CHUNK_SIZE):
+        chunk = rows[i:i + SEND_CHUNK_SIZE]
+        results.extend(await asyncio.gather(*(send(row) for row in chunk)))
+    return results
+
+async def check_due_tasks() -> int:
+    """
+    Разбирает таблицу reminders: наступившие неотправленные напоминания
+    атомарно помечаются отправленными (UPDATE ... RETURNING, FOR UPDATE SKIP
+    LOCKED) пачками по CLAIM_BATCH_SIZE. Если отправить не удалось из-за
+    временной ошибки, отметка снимается, и напоминание попадёт в следующий цикл.
+    После финального напоминания задача переходит в статус notified.
+    При REMINDER_DIGEST_WINDOW > 0 исполнитель получает одну сводку на цикл.
+    Возвращает число отложенных на повтор отправок.
+    """
+    now = datetime.now()
+    failed_total = 0
+
+    while True:
+        if REMINDER_DIGEST_WINDOW > 0:
+            rows = await db.fetch("claim_reminders_digest", now, CLAIM_BATCH_SIZE, REMINDER_DIGEST_WINDOW)
+        else:
+            rows = await db.fetch("claim_reminders", now, CLAIM_BATCH_SIZE)
+        if not rows:
+            break
+        failed = await deliver_claimed(rows)
+        failed_total += failed
+        # Возвращённые напоминания не захватываем повторно в этом же цикле
+        if failed or len(rows) < CLAIM_BATCH_SIZE:
+            break
+
+    return failed_total
+
+async def deliver_claimed(rows) -> int:
+    """
+    Отправляет захваченные напоминания и записывает итог каждого в журнал.
+    Захват снимается только после временных ошибок; возвращает их число.
+    """
+    if REMINDER_DIGEST_WINDOW > 0:
+        # Одна отправка на исполнителя; её итог записывается всем напоминаниям группы
+        groups = _group_by_assignee(rows)
+        sent = await _send_in_chunks(groups, _send_group)
+        rows = [row for group in groups for row in group]
+        results = [result for group, result in zip(groups, sent) for _ in group]
+    else:
+        results = await _send_in_chunks(rows, _send_due)
+    retry = [row["id"] for row, (outcome, _) in zip(rows, results) if outcome == OUTCOME_RETRY]
+    done = [(row, outcome, message_id) for row, (outcome, message_id) in zip(rows, results)
+            if outcome != OUTCOME_RETRY]
+    if retry:
+        await db.execute("release_reminders", retry, REMINDER_MAX_ATTEMPTS)
+    if done:
+        await db.execute(
+            "record_outcomes",
+            [row["id"] for row, _, _ in done],
+            [outcome for _, outcome, _ in done],
+            [message_id for _, _, message_id in done],
+        )
+    notified = [row["task_id"] for row, outcome, _ in done
+                if row["kind"] == FINAL and outcome == OUTCOME_SENT]
+    if notified:
+        await db.execute("mark_tasks_notified", notified)
+    return len(retry)
+
+# === ВОССТАНОВЛЕНИЕ НАПОМИНАНИЙ ПРИ СТАРТЕ ===
+RESTORE_HORIZON = timedelta(seconds=float(os.getenv("RESTORE_HORIZON", "3600")))
+RESTORE_CHUNK_SIZE = int(os.getenv("RESTORE_CHUNK_SIZE", "2000"))
+# Просроченные к старту напоминания уходят не быстрее RESTORE_CATCHUP_RATE в
+# секунду, но все укладываются в RESTORE_CATCHUP_WINDOW секунд
+RESTORE_CATCHUP_RATE = float(os.getenv("RESTORE_CATCHUP_RATE", "20"))
+RESTORE_CATCHUP_WINDOW = float(os.getenv("RESTORE_CATCHUP_WINDOW", "300"))
+
+# Выставляется в dp.startup: бот подключился и принимает апдейты
+bot_ready = asyncio.Event()
+
+@dp.startup.register
+async def on_startup():
+    bot_ready.set()
+
+async def restore_pending_checks():
+    """
+    Раздвигает просроченные напоминания по окну догонки и поднимает в памяти
+    напоминания ближайшего часа. Строки читаются серверным курсором порциями
+    по RESTORE_CHUNK_SIZE, между порциями цикл событий отдаётся апдейтам.
+    Более поздние напоминания разбирает check_due_tasks.
+    """
+    started = time.perf_counter()
+    now = datetime.now()
+    spread = await db.execute(
+        "spread_overdue_reminders", now, 1 / RESTORE_CATCHUP_RATE, RESTORE_CATCHUP_WINDOW
+    )
+    overdue = int(spread.split()[-1])
+
+    restored = 0
+    async with db.transaction() as conn:
+        cursor = await conn.cursor(db.QUERIES["upcoming_reminders"], now, now + RESTORE_HORIZON)
+        while True:
+            rows = await cursor.fetch(RESTORE_CHUNK_SIZE)
+            for row in rows:
+                scheduler.add(row["fire_at"], row["task_id"], row["kind"])
+            restored += len(rows)
+            if len(rows) < RESTORE_CHUNK_SIZE:
+                break
+            await asyncio.sleep(0)
+
+    log.info("Напоминания восстановлены", extra=kv(
+        restored=restored, overdue_spread=overdue, seconds=round(time.perf_counter() - started, 2)
+    ))
+
+# === ОЧИСТКА УСТАРЕВШИХ СОСТОЯНИЙ FSM ===
+async def fsm_janitor():
+    while True:
+        try:
+            await storage.purge_expired()
+        except Exception as e:
+            log.error("Ошибка очистки состояний FSM", extra=kv(error=e, reason=type(e).__name__))
+        await asyncio.sleep(3600)
 
 # === ОБРАБОТКА КНОПОК ===
-@router.callback_query(F.data.startswith("interim_done_"))
-async def interim_done(callback: CallbackQuery):
-    parts = callback.data.split("_")
-    task_id = int(parts[2])
-    creator_id = int(parts[3])
-    conn = await get_db()
-    try:
-        await conn.execute("UPDATE tasks SET status = 'done' WHERE id = $1", task_id)
-    finally:
-        await conn.close()
+@callback_routes.on(cb.InterimDone)
+async def interim_done(callback: CallbackQuery, payload: cb.InterimDone, state: FSMContext):
+    task_id = payload.task_id
+    creator_id = payload.creator_id
+    await db.execute("set_task_status", task_id, "done")
+    scheduler.cancel(task_id)
     await callback.message.edit_text("✅ Задача завершена досрочно!")
-    try:
-        await callback.bot.send_message(creator_id, "🔔 Исполнитель завершил задачу раньше срока!")
-    except:
-        pass
+    delivery.notify(creator_id, "🔔 Исполнитель завершил задачу раньше срока!")
     await callback.answer()
 
-@router.callback_query(F.data.startswith("interim_ok_"))
-async def interim_ok(callback: CallbackQuery):
+@callback_routes.on(cb.InterimOk)
+async def interim_ok(callback: CallbackQuery, payload: cb.InterimOk, state: FSMContext):
     await callback.message.edit_text("👍 Молодец! Времени ещё достаточно.")
     await callback.answer()
 
-@router.callback_query(F.data.startswith("interim_problem_"))
-async def interim_problem(callback: CallbackQuery, state: FSMContext):
-    parts = callback.data.split("_")
-    task_id = int(parts[2])
-    creator_id = int(parts[3])
+@callback_routes.on(cb.InterimProblem)
+async def interim_problem(callback: CallbackQuery, payload: cb.InterimProblem, state: FSMContext):
+    task_id = payload.task_id
+    creator_id = payload.creator_id
     await state.update_data(problem_task_id=task_id, problem_creator_id=creator_id)
-    await callback.message.edit_text("🔧 Опишите проблему:")
     await state.set_state(TaskCreation.waiting_for_problem_description)
+    await callback.message.edit_text("🔧 Опишите проблему:")
     await callback.answer()
 
 @router.message(TaskCreation.waiting_for_problem_description)
@@ -717,58 +871,115 @@ async def handle_problem_description(message: Message, state: FSMContext):
     data = await state.get_data()
     creator_id = data["problem_creator_id"]
     problem_text = message.text
-    try:
-        await message.bot.send_message(
-            creator_id,
-            f"⚠️ У исполнителя возникла проблема с задачей:\n\n«{problem_text}»"
-        )
-    except:
-        pass
+    delivery.notify(creator_id, f"⚠️ У исполнителя возникла проблема с задачей:\n\n«{problem_text}»")
     await message.answer("📤 Проблема отправлена заказчику.")
     await state.clear()
 
-@router.callback_query(F.data.startswith("done_"))
-async def task_done(callback: CallbackQuery):
-    parts = callback.data.split("_")
-    task_id = int(parts[1])
-    creator_id = int(parts[2])
-    conn = await get_db()
-    try:
-        await conn.execute("UPDATE tasks SET status = 'done' WHERE id = $1", task_id)
-    finally:
-        await conn.close()
+@callback_routes.on(cb.TaskDone)
+async def task_done(callback: CallbackQuery, payload: cb.TaskDone, state: FSMContext):
+    task_id = payload.task_id
+    creator_id = payload.creator_id
+    await db.execute("set_task_status", task_id, "done")
+    scheduler.cancel(task_id)
     await callback.message.edit_text("✅ Задача выполнена!")
-    try:
-        await callback.bot.send_message(creator_id, "🔔 Задача отмечена как **выполненная**!")
-    except:
-        pass
+    delivery.notify(creator_id, "🔔 Задача отмечена как **выполненная**!")
     await callback.answer()
 
-@router.callback_query(F.data.startswith("notdone_"))
-async def task_not_done(callback: CallbackQuery):
-    parts = callback.data.split("_")
-    task_id = int(parts[1])
-    creator_id = int(parts[2])
-    conn = await get_db()
-    try:
-        await conn.execute("UPDATE tasks SET status = 'failed' WHERE id = $1", task_id)
-    finally:
-        await conn.close()
+@callback_routes.on(cb.TaskNotDone)
+async def task_not_done(callback: CallbackQuery, payload: cb.TaskNotDone, state: FSMContext):
+    task_id = payload.task_id
+    creator_id = payload.creator_id
+    await db.execute("set_task_status", task_id, "failed")
+    scheduler.cancel(task_id)
     await callback.message.edit_text("❌ Задача не выполнена в срок.")
-    try:
-        await callback.bot.send_message(creator_id, "🔔 Задача **не была выполнена** в срок.")
-    except:
-        pass
+    delivery.notify(creator_id, "🔔 Задача **не была выполнена** в срок.")
+    await callback.answer()
+
+# === КНОПКИ СВОДКИ НАПОМИНАНИЙ ===
+async def refresh_digest(callback: CallbackQuery, page: int):
+    """Перерисовывает сводку по журналу доставки: задачи с ответом из неё пропадают"""
+    items = await db.fetch("digest_tasks", callback.from_user.id, callback.message.message_id)
+    text, kb = render_digest(items, page)
+    if text is None:
+        await callback.message.edit_text("✅ Все задачи из сводки отмечены.")
+    else:
+        await callback.message.edit_text(text, reply_markup=kb)
+
+@callback_routes.on(cb.DigestPage)
+async def digest_page(callback: CallbackQuery, payload: cb.DigestPage, state: FSMContext):
+    await refresh_digest(callback, payload.page)
     await callback.answer()
 
+DIGEST_RESULTS = {
+    "d": ("done", "✅ Задача выполнена!", "🔔 Задача отмечена как **выполненная**!"),
+    "i": ("done", "✅ Задача завершена досрочно!", "🔔 Исполнитель завершил задачу раньше срока!"),
+    "n": ("failed", "❌ Задача не выполнена в срок.", "🔔 Задача **не была выполнена** в срок."),
+}
+
+@callback_routes.on(cb.DigestAction)
+async def digest_action(callback: CallbackQuery, payload: cb.DigestAction, state: FSMContext):
+    task_id = payload.task_id
+    creator_id = payload.creator_id
+    if payload.action == "o":
+        await callback.answer("👍 Молодец! Времени ещё достаточно.")
+        return
+    if payload.action == "p":
+        await state.update_data(problem_task_id=task_id, problem_creator_id=creator_id)
+        await state.set_state(TaskCreation.waiting_for_problem_description)
+        await callback.message.answer("🔧 Опишите проблему:")
+        await callback.answer()
+        return
+    result = DIGEST_RESULTS.get(payload.action)
+    if result is None:
+        await callback.answer()
+        return
+    status, answer, creator_text = result
+    await db.execute("set_task_status", task_id, status)
+    scheduler.cancel(task_id)
+    delivery.notify(creator_id, creator_text)
+    await callback.answer(answer)
+    await refresh_digest(callback, payload.page)
+
 # === ПОДКЛЮЧЕНИЕ ROUTER ===
+# Хендлеры проверяются в порядке регистрации: общий обработчик сообщений —
+# последним, иначе он перехватывает ввод в шагах мастера (waiting_for_text и др.)
+router.message.register(handle_any_message)
+# Все callback-кнопки обслуживает один хендлер с таблицей маршрутов
+callback_routes.attach(router)
 dp.include_router(router)
 
 async def main():
+    logs.setup()
     await init_db()
-    asyncio.create_task(delayed_restore())  # ← КЛЮЧЕВОЕ ИЗМЕНЕНИЕ
-    asyncio.create_task(background_checker())
-    await dp.start_polling(bot)
+    await db.create_pool(DATABASE_URL)
+    metrics_runner = await metrics.start_server()
+    scheduler.start()
+    delivery.start()
+    users.start()
+    try:
+        # Фоновые проверки и восстановление напоминаний — только на реплике-лидере
+        leader.add_job(background_checker)
+        leader.add_job(fsm_janitor)
+        leader.add_job(archiver)
+        leader.start()
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await coalescer.stop()
+        await leader.stop()
+        await scheduler.stop()
+        await delivery.stop()
+        await users.stop()
+        await db.close_pool()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        logs.shutdown()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if WORKER_PROCESSES > 1:
+        # Фронт: сам апдейты не обрабатывает, а раздаёт их дочерним процессам bot.py
+        asyncio.run(run_front(bot, dp.resolve_used_update_types(), BOT_MODE))
+    else:
+        asyncio.run(main())
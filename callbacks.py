@@ -0,0 +1,217 @@
+# callbacks.py — типизированные callback_data и маршрутизация одним поиском в словаре
+#
+# Формат: "<префикс>:<поле>:<поле>...". Префикс — 1–2 символа, поэтому в
+# лимит Telegram в 64 байта помещается больше данных. Строка разбирается один
+# раз в объект payload с __slots__, и он передаётся хендлеру вместе с
+# callback и FSMContext: handler(callback, payload, state).
+from aiogram import Router
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery
+
+import metrics
+
+SEP = ":"
+MAX_LENGTH = 64  # лимит Telegram на callback_data в байтах
+
+_PAYLOADS: dict[str, type["CallbackPayload"]] = {}
+
+
+class CallbackPayload:
+    """Базовый класс: поля перечисляются в __slots__, их типы — в types."""
+    __slots__ = ()
+    prefix = ""
+    types: tuple = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def pack(self) -> str:
+        data = SEP.join((self.prefix, *(str(getattr(self, name)) for name in self.__slots__)))
+        if len(data.encode()) > MAX_LENGTH:
+            raise ValueError(f"callback_data длиннее {MAX_LENGTH} байт: {data}")
+        return data
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+def _register(prefix: str):
+    def decorator(cls):
+        if prefix in _PAYLOADS:
+            raise ValueError(f"Префикс callback_data «{prefix}» уже занят {_PAYLOADS[prefix].__name__}")
+        cls.prefix = prefix
+        _PAYLOADS[prefix] = cls
+        return cls
+    return decorator
+
+
+# === ПОЛЕЗНЫЕ НАГРУЗКИ КНОПОК ===
+@_register("cf")
+class ConfirmNewTask(CallbackPayload):
+    __slots__ = ("action",)
+    types = (str,)
+
+
+@_register("cx")
+class CancelNewTask(CallbackPayload):
+    __slots__ = ()
+
+
+@_register("qt")
+class QuickTask(CallbackPayload):
+    __slots__ = ()
+
+
+@_register("ig")
+class Ignore(CallbackPayload):
+    __slots__ = ()
+
+
+@_register("as")
+class AssignToSelf(CallbackPayload):
+    __slots__ = ()
+
+
+@_register("pu")
+class PickUser(CallbackPayload):
+    __slots__ = ("user_id",)
+    types = (int,)
+
+
+@_register("af")
+class AssignByForward(CallbackPayload):
+    __slots__ = ()
+
+
+@_register("sd")
+class SelectDate(CallbackPayload):
+    __slots__ = ("day",)
+    types = (str,)
+
+
+@_register("sh")
+class SelectHour(CallbackPayload):
+    __slots__ = ("hour",)
+    types = (int,)
+
+
+@_register("sm")
+class SelectMinute(CallbackPayload):
+    __slots__ = ("minute",)
+    types = (int,)
+
+
+@_register("mt")
+class MyTasksPage(CallbackPayload):
+    __slots__ = ("role", "direction", "cursor", "cursor_id")
+    types = (str, str, str, int)
+
+
+@_register("id")
+class InterimDone(CallbackPayload):
+    __slots__ = ("task_id", "creator_id")
+    types = (int, int)
+
+
+@_register("io")
+class InterimOk(CallbackPayload):
+    __slots__ = ("task_id",)
+    types = (int,)
+
+
+@_register("ip")
+class InterimProblem(CallbackPayload):
+    __slots__ = ("task_id", "creator_id")
+    types = (int, int)
+
+
+@_register("dn")
+class TaskDone(CallbackPayload):
+    __slots__ = ("task_id", "creator_id")
+    types = (int, int)
+
+
+@_register("nd")
+class TaskNotDone(CallbackPayload):
+    __slots__ = ("task_id", "creator_id")
+    types = (int, int)
+
+
+# Сводка напоминаний: действие d/n — выполнено/не сделано, i/o/p — готово,
+# в процессе, проблемы; page — страница, которую нужно перерисовать
+@_register("dg")
+class DigestAction(CallbackPayload):
+    __slots__ = ("action", "task_id", "creator_id", "page")
+    types = (str, int, int, int)
+
+
+@_register("dp")
+class DigestPage(CallbackPayload):
+    __slots__ = ("page",)
+    types = (int,)
+
+
+# Кнопки напоминаний живут в чатах неделями: старый формат
+# "<префикс>_<id>_<id>" по-прежнему разбирается. Длинные префиксы — раньше,
+# чтобы "done_" не перехватывал "interim_done_".
+_LEGACY = (
+    ("interim_done_", InterimDone),
+    ("interim_ok_", InterimOk),
+    ("interim_problem_", InterimProblem),
+    ("notdone_", TaskNotDone),
+    ("done_", TaskDone),
+)
+
+
+def _build(cls: type[CallbackPayload], parts: list[str]) -> CallbackPayload | None:
+    if len(parts) != len(cls.types):
+        return None
+    try:
+        return cls(*(convert(part) for convert, part in zip(cls.types, parts)))
+    except ValueError:
+        return None
+
+
+def _parse_legacy(data: str) -> CallbackPayload | None:
+    for prefix, cls in _LEGACY:
+        if data.startswith(prefix):
+            return _build(cls, data[len(prefix):].split("_"))
+    return None
+
+
+def parse(data: str | None) -> CallbackPayload | None:
+    if not data:
+        return None
+    prefix, _, rest = data.partition(SEP)
+    cls = _PAYLOADS.get(prefix)
+    if cls is None:
+        return _parse_legacy(data)
+    return _build(cls, rest.split(SEP) if rest else [])
+
+
+# === МАРШРУТИЗАЦИЯ ===
+class CallbackRoutes:
+    """Таблица payload-класс -> хендлер; в aiogram регистрируется один хендлер на все кнопки."""
+
+    def __init__(self):
+        self._handlers: dict[type[CallbackPayload], object] = {}
+
+    def on(self, payload_cls: type[CallbackPayload]):
+        def decorator(handler):
+            self._handlers[payload_cls] = handler
+            return handler
+        return decorator
+
+    def attach(self, router: Router):
+        router.callback_query.register(self.dispatch)
+
+    async def dispatch(self, callback: CallbackQuery, state: FSMContext):
+        payload = parse(callback.data)
+        handler = self._handlers.get(type(payload))
+        if handler is None:
+            # Неизвестная или устаревшая кнопка — просто гасим «часики»
+            await callback.answer()
+            return
+        await metrics.observe_handler(handler.__name__, handler(callback, payload, state))
@@ -0,0 +1,94 @@
+# coalesce.py — склейка альбомов и серий сообщений в один запрос «Создать задачу?»
+import asyncio
+import os
+import time
+
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Message
+
+import logs
+from logs import kv
+
+# Сколько ждать следующего сообщения серии и сколько максимум держать серию
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "0.8"))
+COALESCE_MAX_DELAY = float(os.getenv("COALESCE_MAX_DELAY", "3"))
+COALESCE_MAX_MESSAGES = int(os.getenv("COALESCE_MAX_MESSAGES", "50"))
+
+log = logs.get("coalesce")
+
+
+class _Burst:
+    __slots__ = ("messages", "state", "started", "timer")
+
+    def __init__(self, state: FSMContext):
+        self.messages: list[Message] = []
+        self.state = state
+        self.started = time.monotonic()
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class MessageCoalescer:
+    """
+    Копит сообщения одного пользователя в чате, пока между ними меньше
+    `window` секунд (но не дольше `max_delay` от первого и не больше
+    `max_messages`), и отдаёт серию целиком в on_flush(messages, state).
+    Альбом копится отдельно по своему media_group_id и без этих пределов:
+    один альбом — всегда одна серия, даже если его части пришли медленно.
+    """
+
+    def __init__(self, on_flush, window: float = COALESCE_WINDOW, max_delay: float = COALESCE_MAX_DELAY,
+                 max_messages: int = COALESCE_MAX_MESSAGES):
+        self._on_flush = on_flush
+        self.window = window
+        self.max_delay = max_delay
+        self.max_messages = max_messages
+        self._bursts: dict[tuple[int, int, str | None], _Burst] = {}
+        self._running: set[asyncio.Task] = set()
+
+    def add(self, message: Message, state: FSMContext):
+        album = message.media_group_id
+        key = (message.chat.id, message.from_user.id if message.from_user else 0, album)
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = self._bursts[key] = _Burst(state)
+        burst.messages.append(message)
+        if burst.timer is not None:
+            burst.timer.cancel()
+
+        if album is not None:
+            # Части альбома ждут друг друга только по окну тишины
+            delay = self.window
+        else:
+            delay = min(self.window, self.max_delay - (time.monotonic() - burst.started))
+        if delay <= 0 or (album is None and len(burst.messages) >= self.max_messages):
+            self._flush(key)
+        else:
+            burst.timer = asyncio.get_running_loop().call_later(delay, self._flush, key)
+
+    def _flush(self, key: tuple[int, int, str | None]):
+        burst = self._bursts.pop(key, None)
+        if burst is None:
+            return
+        if burst.timer is not None:
+            burst.timer.cancel()
+        task = asyncio.create_task(self._emit(burst))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _emit(self, burst: _Burst):
+        try:
+            await self._on_flush(burst.messages, burst.state)
+        except Exception as e:
+            log.error("Ошибка обработки серии сообщений", extra=kv(
+                chat_id=burst.messages[0].chat.id, messages=len(burst.messages), error=e, reason=type(e).__name__
+            ))
+
+    def pending(self) -> int:
+        return len(self._bursts)
+
+    async def stop(self):
+        """Отдаёт накопленные серии сразу и дожидается их обработки."""
+        for key in list(self._bursts):
+            self._flush(key)
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
@@ -0,0 +1,384 @@
+# db.py — общий пул соединений asyncpg и именованные запросы
+import os
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+import metrics
+
+# Настройки пула (переопределяются через переменные окружения)
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "5"))
+COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+MAX_INACTIVE_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_LIFETIME", "300"))
+
+def _mytasks_page(where: str, op: str, order: str) -> str:
+    """
+    Страница активных задач пользователя $1 после/до курсора ($2, $3), $4 строк.
+    Для «все задачи» условие OR разбито на две ветки, каждая из которых идёт
+    по своему индексу (assignee/creator, deadline, id).
+    """
+    def branch(cond: str) -> str:
+        return f"""
+            SELECT id, text, deadline, creator_id
+            FROM tasks
+            WHERE status = 'pending' AND {cond} AND (deadline, id) {op} ($2, $3)
+            ORDER BY deadline {order}, id {order}
+            LIMIT $4
+        """
+    if where == "all":
+        return f"""
+            ({branch("assignee_id = $1")})
+            UNION ALL
+            ({branch("creator_id = $1 AND assignee_id != $1")})
+            ORDER BY deadline {order}, id {order}
+            LIMIT $4
+        """
+    return branch(where)
+
+
+# === ГОРЯЧИЕ ЗАПРОСЫ ===
+# Каждый запрос подготавливается на соединении при первом выполнении и дальше
+# берётся из кэша подготовленных выражений asyncpg (statement_cache_size —
+# с запасом больше числа запросов здесь).
+QUERIES = {
+    # Пакетная запись изменившихся профилей (users.py); неизменные строки не трогаем
+    "upsert_users": """
+        INSERT INTO users (user_id, full_name, username)
+        SELECT * FROM unnest($1::bigint[], $2::text[], $3::text[])
+        ON CONFLICT (user_id) DO UPDATE
+        SET full_name = EXCLUDED.full_name, username = EXCLUDED.username
+        WHERE users.full_name IS DISTINCT FROM EXCLUDED.full_name
+           OR users.username IS DISTINCT FROM EXCLUDED.username
+    """,
+    "get_user": """
+        SELECT user_id, full_name, username FROM users WHERE user_id = $1
+    """,
+    # Последние исполнители постановщика: не больше 10 строк по индексу
+    "frequent_assignees": """
+        SELECT r.assignee_id AS user_id, u.full_name, u.username
+        FROM recent_assignees r
+        LEFT JOIN users u ON u.user_id = r.assignee_id
+        WHERE r.creator_id = $1
+        ORDER BY r.last_assigned_at DESC
+        LIMIT 10
+    """,
+    "touch_recent_assignee": """
+        INSERT INTO recent_assignees (creator_id, assignee_id, last_assigned_at)
+        VALUES ($1, $2, NOW())
+        ON CONFLICT (creator_id, assignee_id) DO UPDATE SET last_assigned_at = NOW()
+    """,
+    # /mytasks: keyset-пагинация по (deadline, id), см. _mytasks_page
+    "mytasks_a_next": _mytasks_page("all", ">", "ASC"),
+    "mytasks_a_prev": _mytasks_page("all", "<", "DESC"),
+    "mytasks_i_next": _mytasks_page("assignee_id = $1", ">", "ASC"),
+    "mytasks_i_prev": _mytasks_page("assignee_id = $1", "<", "DESC"),
+    "mytasks_o_next": _mytasks_page("creator_id = $1", ">", "ASC"),
+    "mytasks_o_prev": _mytasks_page("creator_id = $1", "<", "DESC"),
+    # Новые задачи и смены статуса публикуются в канал task_events (NOTIFY
+    # уходит при коммите), чтобы фоновая проверка пересчитала ближайший срок
+    "insert_task": """
+        WITH ins AS (
+            INSERT INTO tasks (creator_id, assignee_id, text, deadline, checkpoints_enabled)
+            VALUES ($1, $2, $3, $4, $5)
+            RETURNING id
+        )
+        SELECT id, pg_notify('task_events', id::text) FROM ins
+    """,
+    # У закрытой задачи неотправленные напоминания удаляются
+    "set_task_status": """
+        WITH upd AS (
+            UPDATE tasks
+            SET status = $2, closed_at = CASE WHEN $2 <> 'pending' THEN NOW() END
+            WHERE id = $1
+            RETURNING id
+        ), dropped AS (
+            DELETE FROM reminders
+            WHERE task_id IN (SELECT id FROM upd) AND sent_at IS NULL AND $2 <> 'pending'
+        )
+        SELECT pg_notify('task_events', id::text) FROM upd
+    """,
+    # Ближайший момент, когда check_due_tasks найдёт работу (индекс reminders_unsent_idx)
+    "next_due_time": """
+        SELECT MIN(fire_at) FROM reminders WHERE sent_at IS NULL
+    """,
+    # === НАПОМИНАНИЯ (таблица reminders) ===
+    "insert_reminders": """
+        INSERT INTO reminders (task_id, kind, fire_at)
+        SELECT $1, kind, fire_at FROM unnest($2::text[], $3::timestamp[]) AS r(kind, fire_at)
+    """,
+    "claim_reminders": """
+        WITH due AS (
+            SELECT id FROM reminders
+            WHERE sent_at IS NULL AND fire_at <= $1
+            ORDER BY fire_at
+            LIMIT $2
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE reminders r SET sent_at = $1, attempts = r.attempts + 1
+        FROM due, tasks t
+        WHERE r.id = due.id AND t.id = r.task_id
+        RETURNING r.id, r.kind, r.task_id, t.creator_id, t.assignee_id, t.text, t.status
+    """,
+    # Снимает захват, пока не исчерпаны попытки ($2); после — напоминание закрывается как failed
+    "release_reminders": """
+        UPDATE reminders
+        SET sent_at = CASE WHEN attempts < $2 THEN NULL ELSE sent_at END,
+            outcome = CASE WHEN attempts < $2 THEN 'retry' ELSE 'failed' END
+        WHERE id = ANY($1::bigint[])
+    """,
+    # Итог доставки: ($1 id, $2 outcome, $3 message_id) — массивами одной пачкой
+    "record_outcomes": """
+        UPDATE reminders r SET outcome = o.outcome, message_id = o.message_id
+        FROM unnest($1::bigint[], $2::text[], $3::bigint[]) AS o (id, outcome, message_id)
+        WHERE r.id = o.id
+    """,
+    # Перепроверка статуса непосредственно перед вызовом Bot API
+    "task_status": """
+        SELECT status FROM tasks WHERE id = $1
+    """,
+    # Захват одного напоминания по срабатыванию таймера в памяти
+    "claim_reminder": """
+        UPDATE reminders r SET sent_at = $3, attempts = r.attempts + 1
+        FROM tasks t
+        WHERE r.task_id = $1 AND r.kind = $2 AND r.sent_at IS NULL AND t.id = r.task_id
+        RETURNING r.id, r.kind, r.task_id, t.creator_id, t.assignee_id, t.text, t.status
+    """,
+    # === СВОДКИ НАПОМИНАНИЙ (REMINDER_DIGEST) ===
+    # Вместе с наступившими захватываются напоминания тех же исполнителей,
+    # срок которых наступит в ближайшие $3 секунд: ($1 now, $2 лимит, $3 окно)
+    "claim_reminders_digest": """
+        WITH assignees AS (
+            SELECT DISTINCT t.assignee_id
+            FROM reminders r JOIN tasks t ON t.id = r.task_id
+            WHERE r.sent_at IS NULL AND r.fire_at <= $1
+        ), due AS (
+            SELECT r.id FROM reminders r JOIN tasks t ON t.id = r.task_id
+            WHERE r.sent_at IS NULL
+              AND r.fire_at <= $1 + $3::float8 * INTERVAL '1 second'
+              AND t.assignee_id IN (SELECT assignee_id FROM assignees)
+            ORDER BY t.assignee_id, r.fire_at
+            LIMIT $2
+            FOR UPDATE OF r SKIP LOCKED
+        )
+        UPDATE reminders r SET sent_at = $1, attempts = r.attempts + 1
+        FROM due, tasks t
+        WHERE r.id = due.id AND t.id = r.task_id
+        RETURNING r.id, r.kind, r.task_id, t.creator_id, t.assignee_id, t.text, t.status, t.deadline
+    """,
+    # Срабатывание таймера в режиме сводок: ($1 task_id, $2 kind, $3 now, $4 окно) —
+    # захватывается это напоминание и все близкие по сроку напоминания его исполнителя
+    "claim_reminder_digest": """
+        WITH target AS (
+            SELECT t.assignee_id
+            FROM reminders r JOIN tasks t ON t.id = r.task_id
+            WHERE r.task_id = $1 AND r.kind = $2 AND r.sent_at IS NULL
+        ), due AS (
+            SELECT r.id FROM reminders r JOIN tasks t ON t.id = r.task_id
+            WHERE r.sent_at IS NULL
+              AND r.fire_at <= $3 + $4::float8 * INTERVAL '1 second'
+              AND t.assignee_id IN (SELECT assignee_id FROM target)
+            FOR UPDATE OF r SKIP LOCKED
+        )
+        UPDATE reminders r SET sent_at = $3, attempts = r.attempts + 1
+        FROM due, tasks t
+        WHERE r.id = due.id AND t.id = r.task_id
+        RETURNING r.id, r.kind, r.task_id, t.creator_id, t.assignee_id, t.text, t.status, t.deadline
+    """,
+    "count_pending_tasks": """
+        SELECT count(*) FROM tasks WHERE id = ANY($1::int[]) AND status = 'pending'
+    """,
+    # Задачи сводки без ответа исполнителя ($1 исполнитель, $2 message_id сводки) —
+    # по журналу доставки. Кроме pending это notified: финальное напоминание
+    # ушло, но «выполнено / не сделано» ещё не нажато. Ветки идут по частичным
+    # индексам tasks_pending_assignee_idx и tasks_closed_assignee_idx.
+    # MAX(kind): 'final' > 'check_90' > 'check_50' и по смыслу, и по алфавиту
+    "digest_tasks": """
+        WITH unanswered AS (
+            SELECT id, creator_id, text, deadline FROM tasks
+            WHERE assignee_id = $1 AND status = 'pending'
+            UNION ALL
+            SELECT id, creator_id, text, deadline FROM tasks
+            WHERE assignee_id = $1 AND status = 'notified'
+        )
+        SELECT o.id AS task_id, o.creator_id, o.text, o.deadline, MAX(r.kind) AS kind
+        FROM unanswered o JOIN reminders r ON r.task_id = o.id
+        WHERE r.message_id = $2
+        GROUP BY o.id, o.creator_id, o.text, o.deadline
+        ORDER BY o.deadline, o.id
+    """,
+    "mark_tasks_notified": """
+        UPDATE tasks SET status = 'notified', closed_at = NOW()
+        WHERE id = ANY($1::int[]) AND status = 'pending'
+    """,
+    "upcoming_reminders": """
+        SELECT task_id, kind, fire_at
+        FROM reminders
+        WHERE sent_at IS NULL AND fire_at > $1 AND fire_at <= $2
+    """,
+    # Просроченные к старту напоминания: ($1 now, $2 интервал между отправками,
+    # $3 окно догонки в секундах) — раздвигаются по времени, а не шлются разом
+    "spread_overdue_reminders": """
+        WITH overdue AS (
+            SELECT id,
+                   row_number() OVER (ORDER BY fire_at, id) - 1 AS n,
+                   count(*) OVER () AS total
+            FROM reminders
+            WHERE sent_at IS NULL AND fire_at <= $1
+        )
+        UPDATE reminders r
+        SET fire_at = $1 + overdue.n * LEAST($2::float8, $3::float8 / overdue.total) * INTERVAL '1 second'
+        FROM overdue
+        WHERE r.id = overdue.id
+    """,
+    # === АРХИВ ЗАКРЫТЫХ ЗАДАЧ (archive.py) ===
+    "oldest_closed_task": """
+        SELECT MIN(closed_at) FROM tasks WHERE status <> 'pending'
+    """,
+    # Перенос пачки: ($1 граница closed_at, $2 размер пачки). Напоминания
+    # перенесённых задач удаляются каскадно
+    "archive_closed_tasks": """
+        WITH moved AS (
+            DELETE FROM tasks
+            WHERE id IN (
+                SELECT id FROM tasks
+                WHERE status <> 'pending' AND closed_at < $1
+                ORDER BY closed_at
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, creator_id, assignee_id, text, deadline, status, created_at, closed_at
+        )
+        INSERT INTO tasks_history (id, creator_id, assignee_id, text, deadline, status, created_at, closed_at)
+        SELECT id, creator_id, assignee_id, text, deadline, status, created_at, closed_at FROM moved
+    """,
+    # /history: ($1 user_id, $2 лимит) — ещё не перенесённые и архивные задачи
+    "task_history": """
+        SELECT text, status, deadline, closed_at, creator_id FROM (
+            (SELECT text, status, deadline, closed_at, creator_id FROM tasks
+             WHERE status <> 'pending' AND assignee_id = $1
+             ORDER BY closed_at DESC LIMIT $2)
+            UNION ALL
+            (SELECT text, status, deadline, closed_at, creator_id FROM tasks
+             WHERE status <> 'pending' AND creator_id = $1 AND assignee_id <> $1
+             ORDER BY closed_at DESC LIMIT $2)
+            UNION ALL
+            (SELECT text, status, deadline, closed_at, creator_id FROM tasks_history
+             WHERE assignee_id = $1
+             ORDER BY closed_at DESC LIMIT $2)
+            UNION ALL
+            (SELECT text, status, deadline, closed_at, creator_id FROM tasks_history
+             WHERE creator_id = $1 AND assignee_id <> $1
+             ORDER BY closed_at DESC LIMIT $2)
+        ) AS closed
+        ORDER BY closed_at DESC
+        LIMIT $2
+    """,
+    # Хранилище FSM (storage.py)
+    "fsm_get": """
+        SELECT state, data FROM fsm_states
+        WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3 AND thread_id = $4
+          AND business_connection_id = $5 AND destiny = $6
+          AND updated_at > NOW() - $7 * INTERVAL '1 second'
+    """,
+    "fsm_upsert": """
+        INSERT INTO fsm_states (bot_id, chat_id, user_id, thread_id, business_connection_id, destiny, state, data)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+        ON CONFLICT (bot_id, chat_id, user_id, thread_id, business_connection_id, destiny) DO UPDATE
+        SET state = $7, data = $8, updated_at = NOW()
+    """,
+    "fsm_delete": """
+        DELETE FROM fsm_states
+        WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3 AND thread_id = $4
+          AND business_connection_id = $5 AND destiny = $6
+    """,
+    "fsm_purge": """
+        DELETE FROM fsm_states WHERE updated_at < NOW() - $1 * INTERVAL '1 second'
+    """,
+}
+
+_pool: asyncpg.Pool | None = None
+
+
+async def create_pool(dsn: str, setup=None) -> asyncpg.Pool:
+    """
+    Создаёт общий для процесса пул. Вызывается один раз из main().
+    setup(conn) — необязательный синхронный хук для каждого нового соединения
+    (например, счётчик запросов в нагрузочном тесте).
+    """
+    global _pool
+
+    async def init(conn: asyncpg.Connection):
+        if setup is not None:
+            setup(conn)
+
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            dsn,
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            command_timeout=COMMAND_TIMEOUT,
+            statement_cache_size=STATEMENT_CACHE_SIZE,
+            max_inactive_connection_lifetime=MAX_INACTIVE_LIFETIME,
+            init=init,
+        )
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def get_pool() -> asyncpg.Pool:
+    if _pool is None:
+        raise RuntimeError("Пул БД не инициализирован: вызовите create_pool() в main()")
+    return _pool
+
+
+def acquire():
+    """Соединение из пула с таймаутом ожидания: `async with db.acquire() as conn:`"""
+    return get_pool().acquire(timeout=ACQUIRE_TIMEOUT)
+
+
+@asynccontextmanager
+async def transaction():
+    """Соединение с открытой транзакцией: `async with db.transaction() as conn:`"""
+    async with acquire() as conn:
+        async with conn.transaction():
+            yield conn
+
+
+# === ВЫПОЛНЕНИЕ ИМЕНОВАННЫХ ЗАПРОСОВ ===
+async def _run(method: str, name: str, args: tuple):
+    """Выполняет запрос и пишет его время в метрики под именем из QUERIES."""
+    async with acquire() as conn:
+        started = time.perf_counter()
+        try:
+            return await getattr(conn, method)(QUERIES[name], *args)
+        except Exception:
+            metrics.DB_QUERY_ERRORS.inc(name)
+            raise
+        finally:
+            metrics.DB_QUERY_LATENCY.observe(time.perf_counter() - started, name)
+
+
+async def execute(name: str, *args):
+    return await _run("execute", name, args)
+
+
+async def fetch(name: str, *args):
+    return await _run("fetch", name, args)
+
+
+async def fetchrow(name: str, *args):
+    return await _run("fetchrow", name, args)
+
+
+async def fetchval(name: str, *args):
+    return await _run("fetchval", name, args)
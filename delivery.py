@@ -0,0 +1,225 @@
+# delivery.py — очередь исходящих сообщений с ограничением скорости
+import asyncio
+import itertools
+import os
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+
+import metrics
+import logs
+from logs import kv
+
+# Приоритеты: меньше — раньше
+PRIORITY_HIGH = 0   # уведомления в ответ на действия пользователей
+PRIORITY_LOW = 1    # напоминания по расписанию
+
+WORKERS = int(os.getenv("DELIVERY_WORKERS", "8"))
+GLOBAL_RATE = float(os.getenv("DELIVERY_GLOBAL_RATE", "30"))
+CHAT_RATE = float(os.getenv("DELIVERY_CHAT_RATE", "1"))
+CHAT_BURST = float(os.getenv("DELIVERY_CHAT_BURST", "3"))
+MAX_RETRIES = int(os.getenv("DELIVERY_MAX_RETRIES", "3"))
+
+log = logs.get("delivery")
+
+# Сколько бакетов чатов держать, прежде чем вычищать простаивающие
+_CHAT_BUCKETS_SOFT_LIMIT = 10_000
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> float:
+        """Берёт токен и возвращает 0, либо возвращает, сколько секунд ждать."""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_idle(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class _Outgoing:
+    __slots__ = ("chat_id", "text", "kwargs", "future", "precheck", "attempt")
+
+    def __init__(self, chat_id: int, text: str, kwargs: dict, future: asyncio.Future | None, precheck=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.future = future
+        self.precheck = precheck
+        self.attempt = 0
+
+
+class DeliveryQueue:
+    """
+    Все исходящие bot.send_message идут через приоритетную очередь. Пул
+    воркеров соблюдает общий лимит Telegram и лимит на каждый чат, а при 429
+    выдерживает retry_after и повторяет отправку.
+    """
+
+    def __init__(self, bot: Bot, workers: int = WORKERS, global_rate: float = GLOBAL_RATE,
+                 chat_rate: float = CHAT_RATE, chat_burst: float = CHAT_BURST, max_retries: int = MAX_RETRIES):
+        self.bot = bot
+        self._workers_count = workers
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: dict[int, TokenBucket] = {}
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._workers: list[asyncio.Task] = []
+        self._paused_until = 0.0
+        self._delayed = 0
+        self._in_flight = 0
+
+    # === ПОСТАНОВКА В ОЧЕРЕДЬ ===
+    def submit(self, chat_id: int, text: str, priority: int = PRIORITY_LOW, precheck=None, **kwargs) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._put(priority, _Outgoing(chat_id, text, kwargs, future, precheck))
+        return future
+
+    async def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_LOW, precheck=None, **kwargs):
+        """
+        Замена bot.send_message: ждёт доставки и возвращает Message или бросает ошибку.
+        precheck — корутина-функция, которую воркер вызывает прямо перед отправкой;
+        если она вернула False, сообщение не отправляется, а результат — None.
+        """
+        return await self.submit(chat_id, text, priority, precheck, **kwargs)
+
+    def notify(self, chat_id: int, text: str, priority: int = PRIORITY_HIGH, **kwargs):
+        """Отправка без ожидания результата; ошибка доставки только логируется."""
+        self._put(priority, _Outgoing(chat_id, text, kwargs, None))
+
+    def _put(self, priority: int, item: _Outgoing):
+        self._queue.put_nowait((priority, next(self._seq), item))
+
+    def _put_later(self, delay: float, priority: int, item: _Outgoing):
+        self._delayed += 1
+
+        def put():
+            self._delayed -= 1
+            self._put(priority, item)
+
+        asyncio.get_running_loop().call_later(delay, put)
+
+    # === ВОРКЕРЫ ===
+    def start(self):
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self._workers_count)]
+
+    async def stop(self, drain_timeout: float = 5.0):
+        if self._workers and drain_timeout:
+            try:
+                await asyncio.wait_for(self._queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= _CHAT_BUCKETS_SOFT_LIMIT:
+                now = time.monotonic()
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.is_idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            priority, _, item = await self._queue.get()
+            try:
+                if item.future is not None and item.future.done():
+                    continue
+                # Лимит на чат: не держим воркер, а откладываем сообщение
+                wait = self._chat_bucket(item.chat_id).try_take()
+                if wait > 0:
+                    self._put_later(wait, priority, item)
+                    continue
+                # Глобальный лимит и пауза после 429
+                while True:
+                    pause = self._paused_until - time.monotonic()
+                    if pause > 0:
+                        await asyncio.sleep(pause)
+                        continue
+                    wait = self._global.try_take()
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                await self._deliver(priority, item)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, priority: int, item: _Outgoing):
+        self._in_flight += 1
+        try:
+            if item.precheck is not None and not await item.precheck():
+                metrics.SEND_RESULTS.inc("skipped")
+                self._resolve(item, result=None)
+                return
+            with metrics.SEND_LATENCY.time():
+                result = await self.bot.send_message(item.chat_id, item.text, **item.kwargs)
+        except TelegramRetryAfter as e:
+            metrics.SEND_RESULTS.inc("rate_limited")
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            self._retry(priority, item, e, e.retry_after)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            metrics.SEND_RESULTS.inc("transient_error")
+            self._retry(priority, item, e, 2 ** item.attempt)
+        except Exception as e:
+            metrics.SEND_RESULTS.inc("error")
+            self._resolve(item, error=e)
+        else:
+            metrics.SEND_RESULTS.inc("ok")
+            self._resolve(item, result=result)
+        finally:
+            self._in_flight -= 1
+
+    def _retry(self, priority: int, item: _Outgoing, error: Exception, delay: float):
+        item.attempt += 1
+        if item.attempt > self._max_retries:
+            metrics.SEND_RESULTS.inc("retries_exhausted")
+            self._resolve(item, error=error)
+            return
+        metrics.SEND_RETRIES.inc()
+        self._put_later(delay, priority, item)
+
+    @staticmethod
+    def _resolve(item: _Outgoing, result=None, error: Exception | None = None):
+        if item.future is None:
+            if error is not None:
+                log.warning("Не удалось отправить сообщение", extra=kv(
+                    chat_id=item.chat_id, error=error, reason=type(error).__name__
+                ))
+            return
+        if item.future.done():
+            return
+        if error is not None:
+            item.future.set_exception(error)
+        else:
+            item.future.set_result(result)
+
+    # === СТАТИСТИКА (metrics.SEND_*) ===
+    def depth(self) -> int:
+        return self._queue.qsize() + self._delayed
+
+    def in_flight(self) -> int:
+        return self._in_flight
@@ -0,0 +1,135 @@
+# keyboards.py — заранее собранные inline-клавиатуры мастера задач
+#
+# Статические клавиатуры собираются один раз при импорте, календарь — один раз
+# в сутки. Клавиатуры задач собираются по шаблону через model_construct без
+# повторной валидации. Готовые объекты общие для всех апдейтов — не изменяйте их.
+from datetime import date, timedelta
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import callbacks as cb
+from scheduler import FINAL
+from users import format_name
+
+
+def _button(text: str, callback_data: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton.model_construct(text=text, callback_data=callback_data)
+
+
+def _markup(*rows: list[InlineKeyboardButton]) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup.model_construct(inline_keyboard=list(rows))
+
+
+def _grid(buttons: list[InlineKeyboardButton], width: int) -> list[list[InlineKeyboardButton]]:
+    return [buttons[i:i + width] for i in range(0, len(buttons), width)]
+
+
+# === СТАТИЧЕСКИЕ КЛАВИАТУРЫ ===
+HOURS = _markup(*_grid([_button(f"{hour:02d}:00", cb.SelectHour(hour).pack()) for hour in range(24)], 6))
+
+MINUTES = _markup([_button(f":{minute:02d}", cb.SelectMinute(minute).pack()) for minute in (0, 15, 30, 45)])
+
+QUICK_TASK_PROMPT = _markup([
+    _button("✅ Создать задачу", cb.QuickTask().pack()),
+    _button("❌ Отмена", cb.Ignore().pack()),
+])
+
+_CONFIRM = {
+    action: _markup([
+        _button("✅ Продолжить", cb.ConfirmNewTask(action).pack()),
+        _button("❌ Отмена", cb.CancelNewTask().pack()),
+    ])
+    for action in ("newtask", "quick_task")
+}
+
+
+def confirm_new_task(next_action: str) -> InlineKeyboardMarkup:
+    return _CONFIRM[next_action]
+
+
+# === КАЛЕНДАРЬ НА 7 ДНЕЙ ===
+_calendar: tuple[date, InlineKeyboardMarkup] | None = None
+
+
+def _build_calendar(today: date) -> InlineKeyboardMarkup:
+    rows = []
+    for i in range(7):
+        date_obj = today + timedelta(days=i)
+        if i == 0:
+            label = f"Сегодня {date_obj.strftime('%d %b')}"
+        elif i == 1:
+            label = f"Завтра {date_obj.strftime('%d %b')}"
+        else:
+            label = date_obj.strftime("%d %b")
+        rows.append([_button(label, cb.SelectDate(date_obj.isoformat()).pack())])
+    return _markup(*rows)
+
+
+def calendar() -> InlineKeyboardMarkup:
+    """Календарь пересобирается только при смене календарного дня."""
+    global _calendar
+    today = date.today()
+    if _calendar is None or _calendar[0] != today:
+        _calendar = (today, _build_calendar(today))
+    return _calendar[1]
+
+
+# === ВЫБОР ИСПОЛНИТЕЛЯ ===
+_ASSIGN_SELF = [_button("👤 Себе", cb.AssignToSelf().pack())]
+_ASSIGN_RECENT_HEADER = [_button("— ⭐ Ранее назначали —", cb.Ignore().pack())]
+_ASSIGN_FORWARD = [_button("📨 Другой пользователь", cb.AssignByForward().pack())]
+
+
+def assignee_picker(frequent) -> InlineKeyboardMarkup:
+    rows = [_ASSIGN_SELF]
+    if frequent:
+        rows.append(_ASSIGN_RECENT_HEADER)
+        for row in frequent:
+            uid = row["user_id"]
+            label = format_name(uid, row["full_name"], row["username"])
+            rows.append([_button(label[:25], cb.PickUser(uid).pack())])
+    rows.append(_ASSIGN_FORWARD)
+    return _markup(*rows)
+
+
+# === КЛАВИАТУРЫ НАПОМИНАНИЙ ===
+def interim(task_id: int, creator_id: int) -> InlineKeyboardMarkup:
+    return _markup(
+        [_button("✅ Готово", cb.InterimDone(task_id, creator_id).pack())],
+        [_button("⏳ В процессе", cb.InterimOk(task_id).pack())],
+        [_button("⚠️ Проблемы", cb.InterimProblem(task_id, creator_id).pack())],
+    )
+
+
+def final(task_id: int, creator_id: int) -> InlineKeyboardMarkup:
+    return _markup(
+        [_button("✅ Выполнено", cb.TaskDone(task_id, creator_id).pack())],
+        [_button("❌ Не сделано", cb.TaskNotDone(task_id, creator_id).pack())],
+    )
+
+
+# === СВОДКА НАПОМИНАНИЙ ===
+def digest(items, first: int, page: int, pages: int) -> InlineKeyboardMarkup:
+    """Строка кнопок на каждую задачу страницы; номера — как в тексте сводки."""
+    rows = []
+    for number, item in enumerate(items, first):
+        task_id, creator_id = item["task_id"], item["creator_id"]
+        if item["kind"] == FINAL:
+            rows.append([
+                _button(f"{number}. ✅", cb.DigestAction("d", task_id, creator_id, page).pack()),
+                _button(f"{number}. ❌", cb.DigestAction("n", task_id, creator_id, page).pack()),
+            ])
+        else:
+            rows.append([
+                _button(f"{number}. ✅", cb.DigestAction("i", task_id, creator_id, page).pack()),
+                _button(f"{number}. ⏳", cb.DigestAction("o", task_id, creator_id, page).pack()),
+                _button(f"{number}. ⚠️", cb.DigestAction("p", task_id, creator_id, page).pack()),
+            ])
+    nav = []
+    if page > 0:
+        nav.append(_button("◀️", cb.DigestPage(page - 1).pack()))
+    if page < pages - 1:
+        nav.append(_button("▶️", cb.DigestPage(page + 1).pack()))
+    if nav:
+        rows.append(nav)
+    return _markup(*rows)
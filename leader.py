@@ -0,0 +1,104 @@
+# leader.py — выбор лидера среди реплик через advisory-lock PostgreSQL
+import asyncio
+import os
+
+import asyncpg
+
+import logs
+from logs import kv
+
+LEADER_LOCK_KEY = int(os.getenv("LEADER_LOCK_KEY", "72000002"))
+LEADER_HEARTBEAT = float(os.getenv("LEADER_HEARTBEAT", "10"))
+LEADER_RETRY = float(os.getenv("LEADER_RETRY", "15"))
+
+log = logs.get("leader")
+
+# Keepalive на стороне сервера: если лидер пропал из сети, Postgres закроет
+# его сессию (и отпустит блокировку) примерно за полминуты
+_SERVER_SETTINGS = {
+    "tcp_keepalives_idle": "10",
+    "tcp_keepalives_interval": "5",
+    "tcp_keepalives_count": "3",
+    "application_name": "deadline-bot-leader",
+}
+
+
+class LeaderElection:
+    """
+    Каждая реплика держит отдельное соединение и пытается взять
+    pg_try_advisory_lock. Взявшая блокировку реплика — лидер: она запускает
+    зарегистрированные фоновые задачи и пингует соединение. Если соединение
+    оборвалось, задачи останавливаются, а блокировку (сессия закрыта)
+    подхватывает следующая реплика.
+    """
+
+    def __init__(self, dsn: str, key: int = LEADER_LOCK_KEY, heartbeat: float = LEADER_HEARTBEAT,
+                 retry: float = LEADER_RETRY):
+        self.dsn = dsn
+        self.key = key
+        self.heartbeat = heartbeat
+        self.retry = retry
+        self.is_leader = False
+        self._jobs = []
+        self._running: list[asyncio.Task] = []
+        self._conn: asyncpg.Connection | None = None
+        self._task: asyncio.Task | None = None
+
+    def add_job(self, factory):
+        """factory — функция без аргументов, возвращающая корутину; запускается у лидера"""
+        self._jobs.append(factory)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        try:
+            while True:
+                try:
+                    await self._campaign()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    log.warning("Соединение лидера потеряно", extra=kv(error=e, reason=type(e).__name__))
+                await self._resign()
+                await asyncio.sleep(self.retry)
+        finally:
+            await self._resign()
+
+    async def _campaign(self):
+        self._conn = await asyncpg.connect(self.dsn, server_settings=_SERVER_SETTINGS)
+        while not await self._conn.fetchval("SELECT pg_try_advisory_lock($1)", self.key):
+            await asyncio.sleep(self.retry)
+
+        self.is_leader = True
+        log.info("Эта реплика стала лидером")
+        self._running = [asyncio.create_task(factory()) for factory in self._jobs]
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            await self._conn.fetchval("SELECT 1", timeout=self.heartbeat)
+
+    async def _resign(self):
+        if self.is_leader:
+            log.warning("Лидерство потеряно, фоновые задачи остановлены")
+        self.is_leader = False
+        for task in self._running:
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+        self._running = []
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            # Закрытие сессии само отпускает advisory-lock
+            try:
+                await asyncio.wait_for(conn.close(), 5)
+            except Exception:
+                conn.terminate()
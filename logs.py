@@ -0,0 +1,146 @@
+# logs.py — неблокирующее структурированное логирование вместо print()
+#
+# Записи кладутся в очередь (QueueHandler) прямо в цикле событий, а в stdout
+# их пишет отдельный поток (QueueListener) — цикл событий никогда не ждёт
+# ввода-вывода логов. Формат — key=value в одну строку:
+#   ts=2026-10-17T12:00:00 level=WARNING logger=deadline.delivery msg="..." chat_id=42
+#
+# Поля передаются через extra=kv(...):
+#   log.warning("Не удалось отправить сообщение", extra=kv(chat_id=42, reason="TelegramForbiddenError"))
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# aiogram на INFO пишет строку на каждый апдейт — по умолчанию только предупреждения
+LOG_LEVEL_AIOGRAM = os.getenv("LOG_LEVEL_AIOGRAM", "WARNING").upper()
+# Одинаковых записей (логгер + сообщение + reason) — не больше LOG_RATE_BURST за LOG_RATE_INTERVAL секунд
+LOG_RATE_BURST = int(os.getenv("LOG_RATE_BURST", "10"))
+LOG_RATE_INTERVAL = float(os.getenv("LOG_RATE_INTERVAL", "60"))
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def get(name: str) -> logging.Logger:
+    return logging.getLogger(f"deadline.{name}")
+
+
+def kv(**fields) -> dict:
+    """Поля записи для extra=: logger.info("...", extra=kv(task_id=1))"""
+    return {"kv": fields}
+
+
+def _quote(value) -> str:
+    text = str(value)
+    if not text or any(ch in text for ch in ' "=\n\t'):
+        text = '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+    return text
+
+
+class KeyValueFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        parts = [
+            f"ts={time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))}",
+            f"level={record.levelname}",
+            f"logger={record.name}",
+            f"msg={_quote(record.getMessage())}",
+        ]
+        for key, value in getattr(record, "kv", {}).items():
+            parts.append(f"{key}={_quote(value)}")
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            parts.append(f"suppressed={suppressed}")
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            parts.append(f"exc={_quote(record.exc_text)}")
+        return " ".join(parts)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Пропускает не больше `burst` одинаковых записей за `interval` секунд.
+    Категория — логгер, шаблон сообщения и поле reason (например, тип ошибки
+    Telegram), поэтому массовые 403 «bot was blocked» не вытесняют остальное.
+    Число отброшенных записей приписывается к первой пропущенной после паузы.
+    """
+
+    def __init__(self, burst: int = LOG_RATE_BURST, interval: float = LOG_RATE_INTERVAL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        # категория -> [начало окна, записей в окне, отброшено]
+        self._windows: dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.CRITICAL:
+            return True
+        fields = getattr(record, "kv", None) or {}
+        category = (record.name, record.msg, fields.get("reason"))
+        now = time.monotonic()
+        window = self._windows.get(category)
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window is not None else 0
+            self._windows[category] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            if len(self._windows) > 10_000:
+                self._prune(now)
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+    def _prune(self, now: float):
+        stale = [key for key, window in self._windows.items() if now - window[0] >= self.interval]
+        for key in stale:
+            del self._windows[key]
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Форматирование — в потоке-писателе; здесь только подставляем аргументы
+        # и снимаем трассировку, пока исключение ещё доступно
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup(level: str = LOG_LEVEL):
+    """Настраивает корневой логгер. Повторный вызов ничего не делает."""
+    global _listener
+    if _listener is not None:
+        return
+    records: queue.SimpleQueue = queue.SimpleQueue()
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(KeyValueFormatter())
+
+    handler = _QueueHandler(records)
+    handler.addFilter(RateLimitFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    logging.getLogger("aiogram").setLevel(LOG_LEVEL_AIOGRAM)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+
+
+def shutdown():
+    """Дописывает очередь и останавливает поток-писатель."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,222 @@
+# metrics.py — счётчики, гистограммы и эндпоинт /metrics в текстовом формате Prometheus
+#
+# Без внешних зависимостей: запись метрики — это поиск в dict и пара сложений,
+# поэтому слой можно держать включённым в проде. Сервер слушает только
+# локальный интерфейс; METRICS_PORT=0 отключает его.
+import bisect
+import os
+import time
+
+from aiohttp import web
+
+import logs
+from logs import kv
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+log = logs.get("metrics")
+
+# Границы корзин в секундах: от быстрых запросов к БД до медленных вызовов Bot API
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = labels
+        REGISTRY.append(self)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        super().__init__(name, doc, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def total(self) -> float:
+        """Сумма по всем меткам."""
+        return sum(self._values.values())
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Значение либо выставляется set(), либо читается функцией в момент опроса."""
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), func=None):
+        super().__init__(name, doc, labels)
+        self._values: dict[tuple, float] = {}
+        self._func = func
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def set_function(self, func):
+        self._func = func
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        if self._func is not None:
+            try:
+                lines.append(f"{self.name} {self._func()}")
+            except Exception:
+                pass
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = buckets
+        # labels -> [счётчики по корзинам (последняя — +Inf), сумма]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            label_str = _labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_str} {total}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+REGISTRY: list[_Metric] = []
+
+
+# === МЕТРИКИ БОТА ===
+UPDATE_LATENCY = Histogram("bot_update_seconds", "Время обработки апдейта", ("type",))
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Время работы хендлера", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в хендлерах", ("handler",))
+
+DB_QUERY_LATENCY = Histogram("bot_db_query_seconds", "Время именованного запроса к БД", ("query",))
+DB_QUERY_ERRORS = Counter("bot_db_query_errors_total", "Ошибки именованных запросов к БД", ("query",))
+
+SEND_LATENCY = Histogram("bot_send_seconds", "Время вызова sendMessage")
+SEND_RESULTS = Counter("bot_send_total", "Результаты вызовов sendMessage", ("result",))
+SEND_QUEUE_DEPTH = Gauge("bot_send_queue_depth", "Сообщений в очереди доставки")
+SEND_IN_FLIGHT = Gauge("bot_send_in_flight", "Вызовов sendMessage в процессе")
+SEND_RETRIES = Counter("bot_send_retries_total", "Повторные постановки в очередь после 429 и сетевых ошибок")
+
+SCHEDULED_REMINDERS = Gauge("bot_scheduled_reminders", "Напоминаний в куче планировщика")
+CHECK_CYCLE_SECONDS = Gauge("bot_check_cycle_seconds", "Длительность последнего цикла check_due_tasks")
+CHECK_CYCLE_LATENCY = Histogram("bot_check_cycle_duration_seconds", "Длительность циклов check_due_tasks")
+COALESCE_PENDING = Gauge("bot_coalesce_pending", "Серий сообщений, ждущих склейки")
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# === MIDDLEWARE AIOGRAM ===
+async def update_middleware(handler, event, data):
+    """Внешний middleware на dp.update: время обработки апдейта по его типу."""
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    finally:
+        UPDATE_LATENCY.observe(time.perf_counter() - started, event.event_type)
+
+
+async def handler_middleware(handler, event, data):
+    """
+    Внутренний middleware на наблюдателях роутера: здесь хендлер уже выбран
+    фильтрами, поэтому метрика пишется по его имени.
+    """
+    handler_object = data.get("handler")
+    name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+    return await observe_handler(name, handler(event, data))
+
+
+async def observe_handler(name: str, awaitable):
+    """Замеряет время и ошибки хендлера; нужен и маршрутизатору callback-кнопок."""
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    except Exception:
+        HANDLER_ERRORS.inc(name)
+        raise
+    finally:
+        HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+
+
+# === HTTP-ЭНДПОИНТ ===
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner | None:
+    """Поднимает /metrics на локальном порту. Возвращает runner для остановки или None."""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info("Метрики доступны", extra=kv(url=f"http://{host}:{port}/metrics"))
+    return runner
@@ -0,0 +1,204 @@
+# migrations.py — версионированные миграции схемы БД
+import asyncpg
+
+import logs
+from logs import kv
+
+# Ключ advisory-lock, чтобы несколько реплик не применяли миграции одновременно
+MIGRATIONS_LOCK_KEY = 72_000_001
+
+log = logs.get("migrations")
+
+# === СПИСОК МИГРАЦИЙ ===
+# Миграции применяются строго по возрастанию версии. Уже выпущенные
+# миграции не редактируются — изменения схемы добавляются новой версией.
+MIGRATIONS = [
+    (1, "начальная схема", """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            full_name TEXT,
+            username TEXT
+        );
+        CREATE TABLE IF NOT EXISTS tasks (
+            id SERIAL PRIMARY KEY,
+            creator_id BIGINT NOT NULL,
+            assignee_id BIGINT NOT NULL,
+            text TEXT NOT NULL,
+            deadline TIMESTAMP NOT NULL,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT NOW(),
+            last_check_time TIMESTAMP,
+            checkpoints_enabled BOOLEAN DEFAULT TRUE
+        );
+    """),
+    (2, "индексы для горячих запросов по задачам", """
+        -- check_due_tasks: активные задачи по дедлайну
+        CREATE INDEX IF NOT EXISTS tasks_pending_deadline_idx
+            ON tasks (deadline)
+            WHERE status = 'pending';
+        CREATE INDEX IF NOT EXISTS tasks_pending_checkpoints_idx
+            ON tasks (deadline)
+            WHERE status = 'pending' AND checkpoints_enabled;
+        -- /mytasks: две ветки OR (исполнитель / постановщик) с сортировкой по дедлайну
+        CREATE INDEX IF NOT EXISTS tasks_pending_assignee_idx
+            ON tasks (assignee_id, deadline, id)
+            WHERE status = 'pending';
+        CREATE INDEX IF NOT EXISTS tasks_pending_creator_idx
+            ON tasks (creator_id, deadline, id)
+            WHERE status = 'pending';
+        -- get_frequent_assignees: история постановщика без обращения к таблице
+        CREATE INDEX IF NOT EXISTS tasks_creator_created_idx
+            ON tasks (creator_id, created_at DESC)
+            INCLUDE (assignee_id);
+    """),
+    (3, "хранилище состояний FSM", """
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            bot_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            thread_id BIGINT NOT NULL DEFAULT 0,
+            business_connection_id TEXT NOT NULL DEFAULT '',
+            destiny TEXT NOT NULL,
+            state TEXT,
+            data TEXT,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (bot_id, chat_id, user_id, thread_id, business_connection_id, destiny)
+        );
+        CREATE INDEX IF NOT EXISTS fsm_states_updated_idx ON fsm_states (updated_at);
+    """),
+    (4, "таблица последних исполнителей постановщика", """
+        CREATE TABLE IF NOT EXISTS recent_assignees (
+            creator_id BIGINT NOT NULL,
+            assignee_id BIGINT NOT NULL,
+            last_assigned_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (creator_id, assignee_id)
+        );
+        CREATE INDEX IF NOT EXISTS recent_assignees_creator_idx
+            ON recent_assignees (creator_id, last_assigned_at DESC);
+        INSERT INTO recent_assignees (creator_id, assignee_id, last_assigned_at)
+        SELECT creator_id, assignee_id, COALESCE(MAX(created_at), NOW())
+        FROM tasks
+        WHERE creator_id != assignee_id
+        GROUP BY creator_id, assignee_id
+        ON CONFLICT DO NOTHING;
+        -- индекс по истории постановщика больше не нужен
+        DROP INDEX IF EXISTS tasks_creator_created_idx;
+    """),
+    (5, "индексы по моментам контрольных точек", """
+        -- next_due_time: ближайшие отметки 50% и 90% без сканирования всех задач
+        CREATE INDEX IF NOT EXISTS tasks_pending_half_idx
+            ON tasks ((created_at + (deadline - created_at) * 0.5))
+            WHERE status = 'pending' AND checkpoints_enabled AND last_check_time IS NULL;
+        CREATE INDEX IF NOT EXISTS tasks_pending_ninety_idx
+            ON tasks ((created_at + (deadline - created_at) * 0.9))
+            WHERE status = 'pending' AND checkpoints_enabled AND last_check_time IS NOT NULL;
+    """),
+    (6, "таблица напоминаний с заранее рассчитанным временем", """
+        CREATE TABLE IF NOT EXISTS reminders (
+            id BIGSERIAL PRIMARY KEY,
+            task_id INTEGER NOT NULL REFERENCES tasks (id) ON DELETE CASCADE,
+            kind TEXT NOT NULL,
+            fire_at TIMESTAMP NOT NULL,
+            sent_at TIMESTAMP,
+            UNIQUE (task_id, kind)
+        );
+        CREATE INDEX IF NOT EXISTS reminders_unsent_idx
+            ON reminders (fire_at)
+            WHERE sent_at IS NULL;
+
+        -- Переносим активные задачи: отметки считаем так же, как раньше
+        -- считал check_due_tasks, уже отправленные помечаем по last_check_time
+        INSERT INTO reminders (task_id, kind, fire_at, sent_at)
+        SELECT id, 'check_50', created_at + (deadline - created_at) * 0.5, last_check_time
+        FROM tasks
+        WHERE status = 'pending' AND checkpoints_enabled AND deadline > created_at
+        UNION ALL
+        SELECT id, 'check_90', created_at + (deadline - created_at) * 0.9,
+               CASE WHEN last_check_time >= created_at + (deadline - created_at) * 0.9
+                    THEN last_check_time END
+        FROM tasks
+        WHERE status = 'pending' AND checkpoints_enabled AND deadline > created_at
+        UNION ALL
+        SELECT id, 'final', deadline, NULL
+        FROM tasks
+        WHERE status = 'pending'
+        ON CONFLICT (task_id, kind) DO NOTHING;
+
+        -- Отметки больше не вычисляются по tasks
+        DROP INDEX IF EXISTS tasks_pending_half_idx;
+        DROP INDEX IF EXISTS tasks_pending_ninety_idx;
+        DROP INDEX IF EXISTS tasks_pending_checkpoints_idx;
+    """),
+    (7, "журнал доставки напоминаний", """
+        -- attempts — сколько раз напоминание захватывали на отправку,
+        -- outcome — чем закончилась последняя попытка
+        ALTER TABLE reminders
+            ADD COLUMN IF NOT EXISTS attempts SMALLINT NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS outcome TEXT,
+            ADD COLUMN IF NOT EXISTS message_id BIGINT;
+        UPDATE reminders SET attempts = 1, outcome = 'sent' WHERE sent_at IS NOT NULL;
+    """),
+    (8, "архив закрытых задач с помесячными секциями", """
+        ALTER TABLE tasks ADD COLUMN IF NOT EXISTS closed_at TIMESTAMP;
+        UPDATE tasks SET closed_at = LEAST(deadline, NOW())
+        WHERE status <> 'pending' AND closed_at IS NULL;
+        -- архиватор: закрытые задачи по времени закрытия
+        CREATE INDEX IF NOT EXISTS tasks_closed_idx
+            ON tasks (closed_at)
+            WHERE status <> 'pending';
+        -- /history: ещё не перенесённые закрытые задачи пользователя
+        CREATE INDEX IF NOT EXISTS tasks_closed_assignee_idx
+            ON tasks (assignee_id, closed_at DESC)
+            WHERE status <> 'pending';
+        CREATE INDEX IF NOT EXISTS tasks_closed_creator_idx
+            ON tasks (creator_id, closed_at DESC)
+            WHERE status <> 'pending';
+
+        -- Секции по месяцам создаёт archive.py перед переносом
+        CREATE TABLE IF NOT EXISTS tasks_history (
+            id INTEGER NOT NULL,
+            creator_id BIGINT NOT NULL,
+            assignee_id BIGINT NOT NULL,
+            text TEXT NOT NULL,
+            deadline TIMESTAMP NOT NULL,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP,
+            closed_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (id, closed_at)
+        ) PARTITION BY RANGE (closed_at);
+        CREATE INDEX IF NOT EXISTS tasks_history_assignee_idx
+            ON tasks_history (assignee_id, closed_at DESC);
+        CREATE INDEX IF NOT EXISTS tasks_history_creator_idx
+            ON tasks_history (creator_id, closed_at DESC);
+    """),
+    (9, "удаление индекса по дедлайну активных задач", """
+        -- check_due_tasks читает reminders, по дедлайну tasks больше не ищут
+        DROP INDEX IF EXISTS tasks_pending_deadline_idx;
+    """),
+]
+
+
+async def run_migrations(conn: asyncpg.Connection):
+    """Применяет недостающие миграции. Безопасно вызывать при каждом старте."""
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_KEY)
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """)
+        applied = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+        for version, description, sql in sorted(MIGRATIONS):
+            if version in applied:
+                continue
+            async with conn.transaction():
+                await conn.execute(sql)
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES ($1, $2)",
+                    version, description
+                )
+            log.info("Применена миграция", extra=kv(version=version, description=description))
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_KEY)
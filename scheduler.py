@@ -0,0 +1,141 @@
+# scheduler.py — планировщик напоминаний на одной min-куче
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import datetime
+
+import logs
+from logs import kv
+
+# Виды напоминаний
+CHECK_50 = "check_50"
+CHECK_90 = "check_90"
+FINAL = "final"
+
+log = logs.get("scheduler")
+
+
+class Reminder:
+    """
+    Компактная запись об одном напоминании. Текст и получатель не хранятся:
+    они читаются из БД в момент срабатывания вместе с захватом строки reminders.
+    """
+    __slots__ = ("fire_at", "task_id", "kind", "cancelled")
+
+    def __init__(self, fire_at: float, task_id: int, kind: str):
+        self.fire_at = fire_at
+        self.task_id = task_id
+        self.kind = kind
+        self.cancelled = False
+
+
+class ReminderScheduler:
+    """
+    Все напоминания лежат в одной куче, отсортированной по времени срабатывания,
+    и обслуживаются одной корутиной. Отмена — ленивая: запись помечается
+    отменённой и выбрасывается, когда доходит до вершины кучи.
+    """
+
+    def __init__(self, on_fire):
+        self._on_fire = on_fire
+        self._heap: list[tuple[float, int, Reminder]] = []
+        self._by_task: dict[int, list[Reminder]] = {}
+        self._seq = itertools.count()
+        self._cancelled = 0
+        self._wakeup = asyncio.Event()
+        self._driver: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled
+
+    # === ДОБАВЛЕНИЕ / ОТМЕНА ===
+    def add(self, fire_at: datetime, task_id: int, kind: str) -> Reminder:
+        reminder = Reminder(fire_at.timestamp(), task_id, kind)
+        heapq.heappush(self._heap, (reminder.fire_at, next(self._seq), reminder))
+        self._by_task.setdefault(task_id, []).append(reminder)
+        # Будим драйвер, только если новое напоминание стало ближайшим
+        if self._heap[0][2] is reminder:
+            self._wakeup.set()
+        return reminder
+
+    def cancel(self, task_id: int) -> int:
+        """Отменяет все напоминания задачи. Возвращает число отменённых."""
+        reminders = self._by_task.pop(task_id, ())
+        for reminder in reminders:
+            if not reminder.cancelled:
+                reminder.cancelled = True
+                self._cancelled += 1
+        if self._cancelled > 64 and self._cancelled > len(self._heap) // 2:
+            self._compact()
+        return len(reminders)
+
+    def reschedule(self, task_id: int, kind: str, fire_at: datetime) -> bool:
+        """Переносит напоминание вида kind задачи на fire_at. False — такого напоминания нет."""
+        for reminder in self._by_task.get(task_id, ()):
+            if reminder.kind == kind and not reminder.cancelled:
+                reminder.cancelled = True
+                self._cancelled += 1
+                self._by_task[task_id].remove(reminder)
+                self.add(fire_at, task_id, kind)
+                return True
+        return False
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+        heapq.heapify(self._heap)
+        self._cancelled = 0
+
+    def _forget(self, reminder: Reminder):
+        reminders = self._by_task.get(reminder.task_id)
+        if reminders is None:
+            return
+        try:
+            reminders.remove(reminder)
+        except ValueError:
+            pass
+        if not reminders:
+            del self._by_task[reminder.task_id]
+
+    # === ДРАЙВЕР ===
+    def start(self):
+        if self._driver is None:
+            self._driver = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._driver is not None:
+            self._driver.cancel()
+            try:
+                await self._driver
+            except asyncio.CancelledError:
+                pass
+            self._driver = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, reminder = heapq.heappop(self._heap)
+                if reminder.cancelled:
+                    self._cancelled -= 1
+                    continue
+                self._forget(reminder)
+                task = asyncio.create_task(self._fire(reminder))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, reminder: Reminder):
+        try:
+            await self._on_fire(reminder)
+        except Exception as e:
+            log.error("Ошибка срабатывания напоминания", extra=kv(
+                task_id=reminder.task_id, kind=reminder.kind, error=e, reason=type(e).__name__
+            ))
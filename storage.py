@@ -0,0 +1,150 @@
+# storage.py — хранилище FSM в PostgreSQL вместо MemoryStorage
+import json
+import os
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.types import TelegramObject
+
+import db
+
+# Через сколько секунд бездействия состояние считается устаревшим
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", str(24 * 3600)))
+
+
+class _Entry:
+    __slots__ = ("state", "data", "dirty")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state = state
+        self.data = data
+        self.dirty = False
+
+
+class _Batch:
+    """Кэш состояний в пределах обработки одного обновления."""
+    __slots__ = ("entries", "closed")
+
+    def __init__(self):
+        self.entries: Dict[tuple, _Entry] = {}
+        self.closed = False
+
+
+_batch: ContextVar[Optional[_Batch]] = ContextVar("fsm_batch", default=None)
+
+
+def _pack(data: Dict[str, Any]) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _key(key: StorageKey) -> tuple:
+    return (key.bot_id, key.chat_id, key.user_id, key.thread_id or 0,
+            key.business_connection_id or "", key.destiny)
+
+
+class PostgresStorage(BaseStorage):
+    """
+    Состояние и данные FSM лежат в таблице fsm_states, поэтому переживают
+    рестарт и видны всем репликам. Внутри одного обновления чтения идут из
+    кэша, а все set_state/update_data сливаются в одну запись. Запись уходит
+    в БД перед первым после изменений вызовом Bot API (request_middleware) —
+    иначе пользователь успел бы нажать следующую кнопку раньше, чем сохранится
+    состояние, — и, если что-то осталось, после обработчика.
+    batch_middleware должен стоять раньше FSM-middleware aiogram, чтобы его
+    чтение состояния тоже попало в кэш.
+    """
+
+    def __init__(self, ttl: int = FSM_STATE_TTL):
+        self.ttl = ttl
+
+    # === КЭШ ОБНОВЛЕНИЯ ===
+    async def batch_middleware(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with self.batched():
+            return await handler(event, data)
+
+    async def request_middleware(self, make_request, bot, method):
+        """Middleware сессии бота: сохраняет изменения FSM до того, как ответ уйдёт в Telegram."""
+        batch = _batch.get()
+        if batch is not None and not batch.closed:
+            await self._flush(batch)
+        return await make_request(bot, method)
+
+    @asynccontextmanager
+    async def batched(self):
+        """Та же склейка записей для кода вне обработчика апдейта."""
+        batch = _Batch()
+        token = _batch.set(batch)
+        try:
+            yield
+        finally:
+            _batch.reset(token)
+            batch.closed = True
+            await self._flush(batch)
+
+    async def _entry(self, key: StorageKey) -> tuple[tuple, _Entry, Optional[_Batch]]:
+        k = _key(key)
+        batch = _batch.get()
+        if batch is not None and batch.closed:
+            batch = None
+        if batch is not None and k in batch.entries:
+            return k, batch.entries[k], batch
+        row = await db.fetchrow("fsm_get", *k, self.ttl)
+        if row is None:
+            entry = _Entry(None, {})
+        else:
+            entry = _Entry(row["state"], json.loads(row["data"]) if row["data"] else {})
+        if batch is not None:
+            batch.entries[k] = entry
+        return k, entry, batch
+
+    async def _write(self, k: tuple, entry: _Entry):
+        # Снимаем отметку до записи: параллельный вызов Bot API не повторит её
+        entry.dirty = False
+        if entry.state is None and not entry.data:
+            await db.execute("fsm_delete", *k)
+        else:
+            await db.execute("fsm_upsert", *k, entry.state, _pack(entry.data) if entry.data else None)
+
+    async def _changed(self, k: tuple, entry: _Entry, batch: Optional[_Batch]):
+        if batch is None:
+            await self._write(k, entry)
+        else:
+            entry.dirty = True
+
+    async def _flush(self, batch: _Batch):
+        for k, entry in list(batch.entries.items()):
+            if entry.dirty:
+                await self._write(k, entry)
+
+    # === ИНТЕРФЕЙС BaseStorage ===
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k, entry, batch = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        await self._changed(k, entry, batch)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, entry, _ = await self._entry(key)
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k, entry, batch = await self._entry(key)
+        entry.data = data.copy()
+        await self._changed(k, entry, batch)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, entry, _ = await self._entry(key)
+        return entry.data.copy()
+
+    async def purge_expired(self) -> str:
+        return await db.execute("fsm_purge", self.ttl)
+
+    async def close(self) -> None:
+        pass
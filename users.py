@@ -0,0 +1,119 @@
+# users.py — кэш профилей пользователей с пакетной записью в БД
+import asyncio
+import os
+from collections import OrderedDict
+
+import db
+import logs
+from logs import kv
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+USER_FLUSH_INTERVAL = float(os.getenv("USER_FLUSH_INTERVAL", "5"))
+USER_FLUSH_BATCH = int(os.getenv("USER_FLUSH_BATCH", "500"))
+
+log = logs.get("users")
+
+
+def format_name(user_id: int, full_name: str, username: str) -> str:
+    if username:
+        return f"@{username}"
+    if full_name and full_name.strip():
+        return full_name
+    return f"Пользователь {user_id}"
+
+
+class UserDirectory:
+    """
+    LRU-справочник user_id -> (full_name, username). В БД пишутся только
+    изменившиеся профили, и не сразу, а пачками раз в USER_FLUSH_INTERVAL
+    секунд или при накоплении USER_FLUSH_BATCH изменений.
+    """
+
+    def __init__(self, capacity: int = USER_CACHE_SIZE, flush_interval: float = USER_FLUSH_INTERVAL,
+                 flush_batch: int = USER_FLUSH_BATCH):
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._cache: OrderedDict[int, tuple[str, str]] = OrderedDict()
+        self._dirty: dict[int, tuple[str, str]] = {}
+        self._flush_now = asyncio.Event()
+        self._flusher: asyncio.Task | None = None
+
+    def _put(self, user_id: int, profile: tuple[str, str]):
+        self._cache[user_id] = profile
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def remember(self, user):
+        """Запоминает профиль из апдейта; запись в БД — только если он изменился."""
+        profile = (user.full_name or "", user.username or "")
+        if self._cache.get(user.id) == profile:
+            self._cache.move_to_end(user.id)
+            return
+        self._put(user.id, profile)
+        self._dirty[user.id] = profile
+        if len(self._dirty) >= self.flush_batch:
+            self._flush_now.set()
+
+    async def get(self, user_id: int) -> tuple[str, str] | None:
+        profile = self._cache.get(user_id)
+        if profile is not None:
+            self._cache.move_to_end(user_id)
+            return profile
+        row = await db.fetchrow("get_user", user_id)
+        if row is None:
+            return None
+        profile = (row["full_name"] or "", row["username"] or "")
+        self._put(user_id, profile)
+        return profile
+
+    async def display_name(self, user_id: int) -> str | None:
+        profile = await self.get(user_id)
+        if profile is None:
+            return None
+        return format_name(user_id, *profile)
+
+    # === ПАКЕТНАЯ ЗАПИСЬ ===
+    async def flush(self):
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        try:
+            await db.execute(
+                "upsert_users",
+                list(batch.keys()),
+                [profile[0] for profile in batch.values()],
+                [profile[1] for profile in batch.values()],
+            )
+        except Exception:
+            # Возвращаем несохранённое, не затирая более свежие изменения
+            for user_id, profile in batch.items():
+                self._dirty.setdefault(user_id, profile)
+            raise
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error("Ошибка записи профилей", extra=kv(pending=len(self._dirty), error=e, reason=type(e).__name__))
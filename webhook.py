@@ -0,0 +1,105 @@
+# webhook.py — приём обновлений через вебхук (aiohttp) вместо long polling
+import asyncio
+import hmac
+import json
+import os
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+import logs
+from logs import kv
+
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8080")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Публичный адрес за балансировщиком; если не задан, setWebhook не вызывается
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Сколько обновлений может быть принято и ещё не обработано; одновременность
+# обработки ограничивает admission.py отдельно для кнопок и сообщений
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+log = logs.get("webhook")
+
+
+class WebhookServer:
+    """
+    Принимает обновления от Telegram, сразу отвечает 200 и передаёт их в
+    общий Dispatcher в фоне. Если принятых, но не обработанных обновлений
+    больше `max_pending`, отвечаем 503, и Telegram повторит доставку
+    (возможно, на другую реплику).
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, *, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET,
+                 max_pending: int = WEBHOOK_MAX_PENDING):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.max_pending = max_pending
+        self._tasks: set[asyncio.Task] = set()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        if len(self._tasks) >= self.max_pending:
+            return web.Response(status=503)
+        try:
+            payload = await request.json(loads=json.loads)
+            update = Update.model_validate(payload, context={"bot": self.bot})
+        except Exception:
+            return web.Response(status=400)
+
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            log.error("Ошибка обработки апдейта", extra=kv(
+                update_id=update.update_id, error=e, reason=type(e).__name__
+            ), exc_info=True)
+
+    async def drain(self, timeout: float = 10.0):
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=timeout)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, *, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+    """Запускает HTTP-сервер и работает, пока задачу не отменят."""
+    server = WebhookServer(dp, bot)
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+
+    await dp.emit_startup(bot=bot)
+    try:
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                WEBHOOK_URL.rstrip("/") + server.path,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+        await site.start()
+        log.info("Вебхук слушает", extra=kv(host=host, port=port, path=server.path))
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await server.drain()
+        await dp.emit_shutdown(bot=bot)
@@ -0,0 +1,324 @@
+# workers.py — многопроцессный режим: фронт раздаёт апдейты N воркерам по user_id
+#
+# Фронт принимает обновления (вебхуком или long polling) и пересылает каждое
+# одному из WORKER_PROCESSES дочерних процессов `python bot.py`, выбранному по
+# user_id (или chat_id). Все апдейты пользователя попадают в один воркер, так
+# что его мастер задач и склейка сообщений работают как в одном процессе.
+# Воркеры — обычный вебхук-режим бота на 127.0.0.1:WORKER_BASE_PORT+i;
+# фоновые задачи по-прежнему выполняет один лидер (leader.py).
+#
+# Фронт пингует /healthz воркеров и перезапускает упавшие или зависшие.
+# Плавный перезапуск: SIGHUP — всех по очереди, POST /workers/<i>/restart
+# с localhost — одного. Пока воркер перезапускается, его апдейты получают 503,
+# и Telegram доставляет их повторно.
+import asyncio
+import hmac
+import json
+import os
+import secrets
+import signal
+import sys
+
+from aiohttp import ClientSession, ClientTimeout, web
+from aiogram import Bot
+
+import logs
+from logs import kv
+from webhook import SECRET_HEADER, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8100"))
+WORKER_HEALTH_INTERVAL = float(os.getenv("WORKER_HEALTH_INTERVAL", "5"))
+WORKER_HEALTH_FAILURES = int(os.getenv("WORKER_HEALTH_FAILURES", "3"))
+WORKER_START_TIMEOUT = float(os.getenv("WORKER_START_TIMEOUT", "60"))
+WORKER_STOP_TIMEOUT = float(os.getenv("WORKER_STOP_TIMEOUT", "20"))
+
+log = logs.get("workers")
+
+_LOOPBACK = ("127.0.0.1", "::1")
+
+
+def shard_key(payload: dict) -> int:
+    """user_id отправителя, иначе chat_id, иначе update_id — без разбора модели aiogram."""
+    for field, event in payload.items():
+        if field == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return int(user["id"])
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return int(chat["id"])
+    return int(payload.get("update_id", 0))
+
+
+class Worker:
+    """Один дочерний процесс бота и HTTP-клиент к нему."""
+
+    def __init__(self, index: int, count: int, secret: str, session: ClientSession):
+        self.index = index
+        self.port = WORKER_BASE_PORT + index
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._count = count
+        self._secret = secret
+        self._session = session
+        self.process: asyncio.subprocess.Process | None = None
+        self.available = False
+        self.failures = 0
+        self.restarts = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def restarting(self) -> bool:
+        return self._lock.locked()
+
+    def _env(self) -> dict:
+        env = dict(os.environ)
+        env.pop("WEBHOOK_URL", None)
+        env.pop("PORT", None)
+        env.update({
+            "WORKER_PROCESSES": "1",
+            "BOT_MODE": "webhook",
+            "WEBHOOK_HOST": "127.0.0.1",
+            "WEBHOOK_PORT": str(self.port),
+            "WEBHOOK_PATH": WEBHOOK_PATH,
+            "WEBHOOK_SECRET": self._secret,
+        })
+        # Лимит Telegram общий на бота — делим его между воркерами
+        env["DELIVERY_GLOBAL_RATE"] = str(float(os.getenv("DELIVERY_GLOBAL_RATE", "30")) / self._count)
+        metrics_port = int(os.getenv("METRICS_PORT", "9100"))
+        env["METRICS_PORT"] = str(metrics_port + self.index) if metrics_port else "0"
+        return env
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py"),
+            env=self._env(),
+            # Отдельная группа процессов: Ctrl+C во фронте не должен прилетать
+            # воркерам напрямую — их останавливает фронт, по одному сигналу
+            start_new_session=True,
+        )
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + WORKER_START_TIMEOUT
+        while loop.time() < deadline:
+            if self.process.returncode is not None:
+                raise RuntimeError(f"воркер {self.index} завершился с кодом {self.process.returncode}")
+            if await self.healthy():
+                self.available = True
+                self.failures = 0
+                log.info("Воркер запущен", extra=kv(worker=self.index, pid=self.process.pid, port=self.port))
+                return
+            await asyncio.sleep(0.5)
+        raise RuntimeError(f"воркер {self.index} не ответил за {WORKER_START_TIMEOUT} с")
+
+    async def stop(self):
+        """SIGINT: бот дорабатывает принятые апдейты и закрывает соединения."""
+        self.available = False
+        process, self.process = self.process, None
+        if process is None or process.returncode is not None:
+            return
+        process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(process.wait(), WORKER_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning("Воркер не остановился вовремя", extra=kv(worker=self.index, pid=process.pid))
+            process.kill()
+            await process.wait()
+
+    async def restart(self, reason: str):
+        async with self._lock:
+            log.warning("Перезапуск воркера", extra=kv(worker=self.index, reason=reason))
+            self.restarts += 1
+            await self.stop()
+            try:
+                await self.start()
+            except Exception as e:
+                log.error("Воркер не запустился", extra=kv(worker=self.index, error=e, reason=type(e).__name__))
+
+    async def healthy(self) -> bool:
+        try:
+            async with self._session.get(f"{self.url}/healthz", timeout=ClientTimeout(total=2)) as response:
+                return response.status == 200
+        except Exception:
+            return False
+
+    async def forward(self, body: bytes) -> int:
+        """Передаёт апдейт воркеру и возвращает HTTP-статус его ответа."""
+        if not self.available:
+            return 503
+        try:
+            async with self._session.post(
+                f"{self.url}{WEBHOOK_PATH}", data=body,
+                headers={SECRET_HEADER: self._secret, "Content-Type": "application/json"},
+            ) as response:
+                return response.status
+        except Exception as e:
+            log.warning("Воркер недоступен", extra=kv(worker=self.index, error=e, reason=type(e).__name__))
+            return 503
+
+
+class WorkerPool:
+    def __init__(self, count: int = WORKER_PROCESSES):
+        self.count = count
+        self.workers: list[Worker] = []
+        self._session: ClientSession | None = None
+        self._monitor: asyncio.Task | None = None
+        self._restarting: set[asyncio.Task] = set()
+
+    async def start(self):
+        self._session = ClientSession(timeout=ClientTimeout(total=30))
+        secret = secrets.token_urlsafe(24)
+        self.workers = [Worker(i, self.count, secret, self._session) for i in range(self.count)]
+        await asyncio.gather(*(worker.start() for worker in self.workers))
+        self._monitor = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, *self._restarting, return_exceptions=True)
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+        if self._session is not None:
+            await self._session.close()
+
+    def worker_for(self, payload: dict) -> Worker:
+        return self.workers[shard_key(payload) % self.count]
+
+    async def forward(self, body: bytes) -> int:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400
+        return await self.worker_for(payload).forward(body)
+
+    def restart(self, worker: Worker, reason: str):
+        task = asyncio.create_task(worker.restart(reason))
+        self._restarting.add(task)
+        task.add_done_callback(self._restarting.discard)
+
+    async def rolling_restart(self):
+        """Перезапускает воркеры по одному, чтобы остальные шарды продолжали работать."""
+        for worker in self.workers:
+            await worker.restart("rolling restart")
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(WORKER_HEALTH_INTERVAL)
+            for worker in self.workers:
+                if worker.restarting:
+                    continue
+                if worker.process is None or worker.process.returncode is not None:
+                    self.restart(worker, "process exited")
+                    continue
+                if await worker.healthy():
+                    worker.failures = 0
+                    continue
+                worker.failures += 1
+                if worker.failures >= WORKER_HEALTH_FAILURES:
+                    self.restart(worker, "health check failed")
+
+    def status(self) -> list[dict]:
+        return [
+            {
+                "worker": worker.index,
+                "pid": worker.process.pid if worker.process else None,
+                "available": worker.available,
+                "restarts": worker.restarts,
+            }
+            for worker in self.workers
+        ]
+
+
+# === ФРОНТ ===
+class FrontServer:
+    def __init__(self, pool: WorkerPool, secret: str = WEBHOOK_SECRET):
+        self.pool = pool
+        self.secret = secret
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        app.router.add_post("/workers/{index}/restart", self.handle_restart)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        status = await self.pool.forward(await request.read())
+        return web.Response(status=status)
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        status = self.pool.status()
+        ok = any(worker["available"] for worker in status)
+        return web.json_response({"workers": status}, status=200 if ok else 503)
+
+    async def handle_restart(self, request: web.Request) -> web.Response:
+        if request.remote not in _LOOPBACK:
+            return web.Response(status=403)
+        try:
+            worker = self.pool.workers[int(request.match_info["index"])]
+        except (ValueError, IndexError):
+            return web.Response(status=404)
+        self.pool.restart(worker, "admin request")
+        return web.Response(status=202)
+
+
+async def _poll(bot: Bot, pool: WorkerPool, allowed_updates: list[str]):
+    """Long polling во фронте: апдейты одного шарда пересылаются по порядку, шарды — параллельно."""
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            log.warning("Ошибка getUpdates", extra=kv(error=e, reason=type(e).__name__))
+            await asyncio.sleep(5)
+            continue
+        shards: dict[int, list[bytes]] = {}
+        for update in updates:
+            body = update.model_dump_json(exclude_unset=True, by_alias=True).encode()
+            payload = json.loads(body)
+            shards.setdefault(pool.worker_for(payload).index, []).append(body)
+        await asyncio.gather(*(_deliver_shard(pool.workers[i], bodies) for i, bodies in shards.items()))
+        if updates:
+            offset = updates[-1].update_id + 1
+
+
+async def _deliver_shard(worker: Worker, bodies: list[bytes]):
+    for body in bodies:
+        delay = 0.5
+        # Пока воркер перезапускается, держим апдейт у себя, а не теряем его
+        while await worker.forward(body) == 503:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10)
+
+
+async def run_front(bot: Bot, allowed_updates: list[str], mode: str):
+    logs.setup()
+    pool = WorkerPool()
+    await pool.start()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(pool.rolling_restart()))
+    # Платформа останавливает контейнер SIGTERM — сначала гасим воркеры
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    runner = web.AppRunner(FrontServer(pool).app(), access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        log.info("Фронт запущен", extra=kv(workers=pool.count, host=WEBHOOK_HOST, port=WEBHOOK_PORT, mode=mode))
+        if mode == "webhook":
+            if WEBHOOK_URL:
+                await bot.set_webhook(
+                    WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                    secret_token=WEBHOOK_SECRET or None,
+                    allowed_updates=allowed_updates,
+                )
+            await asyncio.Event().wait()
+        else:
+            await bot.delete_webhook()
+            await _poll(bot, pool, allowed_updates)
+    finally:
+        await runner.cleanup()
+        await pool.stop()
+        await bot.session.close()
+        logs.shutdown()